@@ -0,0 +1,48 @@
+"""
+Compares the previous byte-at-a-time response assembly with the buffered read
+used by the request helpers, for large binary bodies (avatars, gallery files)
+
+Usage: python benchmarks/bench_response_read.py
+"""
+import os
+import timeit
+from io import BytesIO
+from requests.models import Response
+from mxit.transport import Transport
+
+SIZES = (10 * 1024, 200 * 1024, 2 * 1024 * 1024)
+REPEAT = 5
+
+
+def _response(body):
+    r = Response()
+    r.status_code = 200
+    r.raw = BytesIO(body)
+    return r
+
+
+def byte_at_a_time(body):
+    r = _response(body)
+    response = ''
+    for chunk in r.iter_content():
+        response += chunk
+    return response
+
+
+def buffered(body, transport=Transport()):
+    return transport.read_body(_response(body))
+
+
+def main():
+    print("%10s %18s %18s %10s" % ('bytes', 'byte-at-a-time ms', 'buffered ms', 'speedup'))
+    for size in SIZES:
+        body = os.urandom(size)
+        assert byte_at_a_time(body) == buffered(body) == body
+
+        before = min(timeit.repeat(lambda: byte_at_a_time(body), number=1, repeat=REPEAT)) * 1000
+        after = min(timeit.repeat(lambda: buffered(body), number=1, repeat=REPEAT)) * 1000
+        print("%10d %18.2f %18.2f %9.0fx" % (size, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Measures the latency and throughput of every MessagingService and UserService method against the local stub
+server (mxit.stub_server), so that changes to the client can be compared without credentials or network access
+
+Usage: python benchmarks/bench_services.py [--requests 200] [--concurrency 1] [--latency 0] [--payload-size 65536]
+                                           [--only get_user_id,send_message]
+"""
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from mxit import Mxit, settings
+from mxit.stub_server import StubServer, DEFAULT_PAYLOAD_SIZE
+
+# A single user token covering every user scope, so that no call needs a new authorisation code
+USER_SCOPES = ' '.join([
+    'profile/public', 'profile/private', 'profile/write', 'status/write', 'avatar/write', 'contact/invite',
+    'graph/read', 'content/read', 'content/write', 'message/user',
+])
+
+
+def calls(client, file_ids, payload):
+    """
+    (name, function of the iteration number) for each service method
+    """
+    messaging, users = client.messaging, client.users
+    recipients = ['user%d' % i for i in range(1000)]
+
+    def file_id(i):
+        return file_ids[i % len(file_ids)]
+
+    return [
+        ('send_message', lambda i: messaging.send_message('app', ['user%d' % i], 'Hello')),
+        ('broadcast_message', lambda i: messaging.broadcast_message('app', recipients, 'Hello')),
+        ('send_user_to_user_message', lambda i: messaging.send_user_to_user_message('user', ['user%d' % i], 'Hi')),
+        ('get_user_id', lambda i: users.get_user_id('mxit%d' % i)),
+        ('get_status', lambda i: users.get_status('mxit%d' % i)),
+        ('set_status', lambda i: users.set_status('Status %d' % i)),
+        ('get_display_name', lambda i: users.get_display_name('mxit%d' % i)),
+        ('get_avatar', lambda i: users.get_avatar('mxit%d' % i)),
+        ('set_avatar', lambda i: users.set_avatar(payload)),
+        ('delete_avatar', lambda i: users.delete_avatar()),
+        ('get_basic_profile', lambda i: users.get_basic_profile('user%d' % i)),
+        ('resolve_mxit_ids', lambda i: list(users.resolve_mxit_ids(['mxit%d' % j for j in range(i, i + 20)]))),
+        ('get_full_profile', lambda i: users.get_full_profile()),
+        ('update_profile', lambda i: users.update_profile(about_me='About %d' % i)),
+        ('add_contact', lambda i: users.add_contact('contact%d' % i)),
+        ('get_contact_list', lambda i: users.get_contact_list('@Friends', count=100)),
+        ('get_friend_suggestions', lambda i: users.get_friend_suggestions()),
+        ('get_gallery_folder_list', lambda i: users.get_gallery_folder_list()),
+        ('create_gallery_folder', lambda i: users.create_gallery_folder('Folder%d' % i)),
+        ('rename_gallery_folder', lambda i: users.rename_gallery_folder('Folder%d' % i, 'Renamed%d' % i)),
+        ('delete_gallery_folder', lambda i: users.delete_gallery_folder('Renamed%d' % i)),
+        ('upload_gallery_file', lambda i: users.upload_gallery_file('Uploads', 'file%d.png' % i, payload)),
+        ('get_gallery_item_list', lambda i: users.get_gallery_item_list('Default', count=100)),
+        ('get_gallery_file', lambda i: users.get_gallery_file(file_id(i))),
+        ('rename_gallery_file', lambda i: users.rename_gallery_file(file_id(i), 'renamed%d.png' % i)),
+        ('upload_file_and_send_file_offer',
+         lambda i: users.upload_file_and_send_file_offer('offer%d.png' % i, 'user%d' % i, payload)),
+        ('send_file_offer', lambda i: users.send_file_offer(file_id(i), 'user%d' % i)),
+        ('get_cover_image', lambda i: users.get_cover_image()),
+        ('set_cover_image', lambda i: users.set_cover_image(payload)),
+        ('delete_gallery_file', lambda i: users.delete_gallery_file(file_id(i))),
+    ]
+
+
+def _percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100.0))]
+
+
+def run(fn, requests, concurrency):
+    """
+    Call fn(i) for i in range(requests), concurrency at a time, returning the elapsed time and each call's latency
+    """
+    def timed(i):
+        start = time.time()
+        fn(i)
+        return time.time() - start
+
+    start = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(timed, range(requests)))
+    return time.time() - start, sorted(latencies)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='calls made to each method')
+    parser.add_argument('--concurrency', type=int, default=1, help='calls in flight at once')
+    parser.add_argument('--latency', type=float, default=0, help='seconds the stub server adds to each response')
+    parser.add_argument('--payload-size', type=int, default=DEFAULT_PAYLOAD_SIZE,
+                        help='bytes in downloaded and uploaded files')
+    parser.add_argument('--only', help='comma separated names of the methods to benchmark')
+    args = parser.parse_args()
+
+    server = StubServer(latency=args.latency, payload_size=args.payload_size, gallery_items=args.requests).start()
+    settings.AUTH_ENDPOINT = settings.API_ENDPOINT = server.url
+
+    client = Mxit('client_id', 'client_secret', redirect_uri='http://localhost/', pool_maxsize=args.concurrency)
+    client.oauth.get_user_token(USER_SCOPES, code='code')
+    client.warm_up()
+
+    file_ids = list(server.state.folders['Default'])
+    payload = '\0' * args.payload_size
+    only = args.only.split(',') if args.only else None
+
+    print "%-32s %10s %10s %10s %10s %10s" % ('method', 'calls/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')
+    try:
+        for name, fn in calls(client, file_ids, payload):
+            if only and name not in only:
+                continue
+
+            elapsed, latencies = run(fn, args.requests, args.concurrency)
+            print "%-32s %10.1f %10.2f %10.2f %10.2f %10.2f" % (
+                name, args.requests / elapsed, _percentile(latencies, 50) * 1000, _percentile(latencies, 95) * 1000,
+                _percentile(latencies, 99) * 1000, latencies[-1] * 1000)
+    finally:
+        client.close()
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
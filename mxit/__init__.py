@@ -1,2 +1,3 @@
 from client import Mxit
+from async_client import AsyncMxit
 from services import CONTACT_LIST_FILTER
\ No newline at end of file
@@ -0,0 +1,73 @@
+from types import GeneratorType
+from concurrent.futures import ThreadPoolExecutor
+from mxit.client import Mxit
+
+DEFAULT_MAX_WORKERS = 50
+
+# Methods that do no I/O and are passed through unwrapped
+_LOCAL_METHODS = ('auth_url', 'create_redirect_link', 'invalidate_cache', 'cache_stats', 'stop_background_refresh')
+
+
+class AsyncService(object):
+    """
+    Wraps a service (or the OAuth provider) so that each of its API calls is submitted to an executor and
+    returns a concurrent.futures.Future instead of blocking the caller
+
+    Calls that return a generator (such as resolve_mxit_ids, iter_contact_list and walk_gallery) make their
+    requests as it is iterated, so it is run to the end on the executor and their Future is of a list.
+    """
+
+    def __init__(self, service, executor):
+        self.service = service
+        self.executor = executor
+
+    def __getattr__(self, name):
+        attr = getattr(self.service, name)
+
+        if name.startswith('_') or name in _LOCAL_METHODS or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if isinstance(result, GeneratorType):
+                return list(result)
+            return result
+
+        def submit(*args, **kwargs):
+            return self.executor.submit(call, *args, **kwargs)
+
+        submit.__name__ = name
+        submit.__doc__ = attr.__doc__
+        return submit
+
+
+class AsyncMxit(object):
+    """
+    Non-blocking Mxit API wrapper
+
+    Mirrors Mxit, but every call on oauth, messaging and users returns a Future. The calls run on a shared
+    pool of max_workers threads over a connection pool of the same size, so many lookups and sends can be
+    in flight at once. Any other keyword arguments are passed on to Mxit.
+    """
+
+    def __init__(self, client_id, client_secret, max_workers=DEFAULT_MAX_WORKERS, executor=None, **kwargs):
+        kwargs.setdefault('pool_maxsize', max_workers)
+        self.client = Mxit(client_id, client_secret, **kwargs)
+        self.transport = self.client.transport
+
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+
+        # Auth
+        self.oauth = AsyncService(self.client.oauth, self.executor)
+
+        # Services
+        self.messaging = AsyncService(self.client.messaging, self.executor)
+        self.users = AsyncService(self.client.users, self.executor)
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting calls, optionally wait for the pending ones, then stop the background refresh of app tokens
+        and close pooled connections
+        """
+        self.executor.shutdown(wait)
+        self.client.close()
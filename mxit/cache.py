@@ -0,0 +1,173 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+DEFAULT_MAX_SIZE = 10000
+
+
+class Cache(object):
+    """
+    Interface of the caches used by the client, such as the shared token cache given to OAuth
+
+    Values are set with a timeout in seconds (None for no expiry) and get returns None for missing or expired
+    keys. Any object with get and set methods (e.g. a memcached or Django cache) can be used in its place;
+    implementing get_with_ttl additionally lets in-process copies expire at the same time as the cached value.
+    """
+
+    def get(self, key):
+        return self.get_with_ttl(key)[0]
+
+    def get_with_ttl(self, key):
+        """
+        Return the value and its remaining lifetime in seconds (None if it doesn't expire), or (None, None)
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, timeout=None):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+
+class LRUCache(Cache):
+    """
+    Thread-safe, size-bounded in-process cache with per-entry TTLs
+
+    Once max_size entries are stored, the least recently used one is evicted to make room. Entries set without
+    a timeout never expire.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key, default=None):
+        value, _ = self.get_with_ttl(key)
+        return default if value is None else value
+
+    def get_with_ttl(self, key):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            ttl = _ttl(entry[0]) if entry is not None else None
+
+            if entry is None or (ttl is not None and ttl <= 0):
+                self.misses += 1
+                return None, None
+
+            # Re-insert to mark as most recently used
+            self.__entries[key] = entry
+            self.hits += 1
+            return entry[1], ttl
+
+    def set(self, key, value, timeout=None):
+        expires_at = _expires_at(timeout)
+
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (expires_at, value)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self, match=None):
+        """
+        Remove all entries, or only those whose key match(key) is true for
+        """
+        with self.__lock:
+            if match is None:
+                self.__entries.clear()
+                return
+
+            for key in [key for key in self.__entries if match(key)]:
+                del self.__entries[key]
+
+    def stats(self):
+        return {
+            'size': len(self.__entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class FileCache(Cache):
+    """
+    Cache persisted to a JSON file
+
+    Lets processes on the same machine share tokens and is handy in tests. Every call reads (and set and
+    delete rewrite) the whole file, so it is only suited to a small number of keys.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = Lock()
+
+    def get_with_ttl(self, key):
+        with self.__lock:
+            entry = _load_json(self.path).get(key)
+
+        if entry is None:
+            return None, None
+
+        value, expires_at = entry
+        ttl = _ttl(expires_at)
+        if ttl is not None and ttl <= 0:
+            return None, None
+        return value, ttl
+
+    def set(self, key, value, timeout=None):
+        with self.__lock:
+            entries = _load_json(self.path)
+            entries[key] = (value, _expires_at(timeout))
+            _save_json(self.path, entries)
+
+    def delete(self, key):
+        with self.__lock:
+            entries = _load_json(self.path)
+            if entries.pop(key, None) is not None:
+                _save_json(self.path, entries)
+
+
+def _load_json(path):
+    """
+    The JSON value stored at path, or an empty dictionary if the file is missing or unreadable
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_json(path, value):
+    # Written to a temporary file first so that readers never see a partially written file
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(value, f)
+    os.rename(temp_path, path)
+
+
+def _expires_at(timeout):
+    return time.time() + timeout if timeout is not None else None
+
+
+def _ttl(expires_at):
+    return expires_at - time.time() if expires_at is not None else None
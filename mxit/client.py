@@ -1,5 +1,7 @@
 from mxit.oauth import OAuth
-from mxit.services import MessagingService, UserService
+from mxit.services import MessagingService, UserService, APP_SCOPES
+from mxit.transport import Transport, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, \
+    DEFAULT_CHUNK_SIZE
 
 
 class Mxit(object):
@@ -7,13 +9,39 @@ class Mxit(object):
     Mxit API wrapper
     """
 
-    def __init__(self, client_id, client_secret, redirect_uri=None, state=None, cache=None, verify_cert=True, oauth_provider=None, user_id=None):
+    def __init__(self, client_id, client_secret, redirect_uri=None, state=None, cache=None, verify_cert=True, oauth_provider=None, user_id=None,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                 profile_cache=None, profile_cache_ttls=None, background_token_refresh=False, retry_policy=None,
+                 rate_limiter=None, metrics=None, tracer=None, file_id_cache=None):
+        # Transport (pooled keep-alive connections, shared by auth and services)
+        self.transport = Transport(pool_connections, pool_maxsize, chunk_size, retry_policy, rate_limiter, metrics,
+                                   tracer)
+
         # Auth
         if oauth_provider:
             self.oauth = oauth_provider(client_id, client_secret, user_id, redirect_uri, state, cache, verify_cert)
         else:
-            self.oauth = OAuth(client_id, client_secret, redirect_uri, state, cache, verify_cert)
+            self.oauth = OAuth(client_id, client_secret, redirect_uri, state, cache, verify_cert, self.transport,
+                               background_token_refresh)
 
         # Services
-        self.messaging = MessagingService(self.oauth)
-        self.users = UserService(self.oauth)
\ No newline at end of file
+        self.messaging = MessagingService(self.oauth, self.transport)
+        self.users = UserService(self.oauth, self.transport, profile_cache, profile_cache_ttls, file_id_cache)
+
+    def warm_up(self, scopes=APP_SCOPES):
+        """
+        Fetch a single app token covering all of the given scopes (by default, all of the scopes the services
+        use app tokens for), so that it is already available to every call made with any of those scopes
+        """
+        if not isinstance(scopes, basestring):
+            scopes = ' '.join(scopes)
+        return self.oauth.get_app_token(scopes)
+
+    def close(self):
+        """
+        Stop the background refresh of app tokens and close pooled connections
+        """
+        # OAuth providers passed in as oauth_provider may not refresh tokens in the background
+        if hasattr(self.oauth, 'stop_background_refresh'):
+            self.oauth.stop_background_refresh()
+        self.transport.close()
@@ -9,3 +9,6 @@ class MxitAPIAuthException(MxitAPIException):
 class MxitAPIParameterException(MxitAPIException):
     pass
 
+
+class MxitAPIRateLimitException(MxitAPIException):
+    pass
@@ -0,0 +1,246 @@
+"""
+Load generator for capacity planning
+
+Drives a weighted mix of app-authenticated calls (message sends, profile lookups, file offer uploads and avatar
+downloads) at a fixed concurrency (each worker making its next call as soon as the last one returns) or at a
+fixed rate (calls started on schedule, with latency measured from when they were due, so that a backlog shows
+up in it), and reports throughput, error rates and latency percentiles per call.
+
+Usage: python -m mxit.loadtest --mix send_message=8,get_user_id=2 --concurrency 20 --duration 30
+       python -m mxit.loadtest --rate 200 --api-endpoint http://localhost:8080 --auth-endpoint http://localhost:8080
+       python -m mxit.loadtest --stub --stub-latency 0.05
+"""
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+from bisect import bisect
+from collections import Counter, defaultdict
+from itertools import count
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from mxit import settings
+from mxit.client import Mxit
+
+OPERATIONS = {
+    'send_message': lambda client, options: client.messaging.send_message(
+        options.app_id, [options.user_id], options.message),
+    'get_user_id': lambda client, options: client.users.get_user_id(options.mxit_id),
+    'get_display_name': lambda client, options: client.users.get_display_name(options.mxit_id),
+    'get_status': lambda client, options: client.users.get_status(options.mxit_id),
+    'get_avatar': lambda client, options: client.users.get_avatar(options.mxit_id),
+    'upload_file_and_send_file_offer': lambda client, options: client.users.upload_file_and_send_file_offer(
+        'loadtest.bin', options.user_id, options.payload),
+}
+
+DEFAULT_MIX = 'send_message=70,get_user_id=20,upload_file_and_send_file_offer=5,get_avatar=5'
+
+
+def parse_mix(text):
+    """
+    Parse 'name=weight,...' into a list of (operation name, weight) pairs
+    """
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ArgumentTypeError("Unknown operation '%s', expected one of: %s"
+                                    % (name, ', '.join(sorted(OPERATIONS))))
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ArgumentTypeError("Invalid weight for '%s'" % name)
+        mix.append((name, weight))
+    return mix
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100.0))]
+
+
+class LoadStats(object):
+    """
+    Thread-safe record of the latency of every call, and of the errors raised, by operation
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.__lock = Lock()
+
+    def record(self, operation, latency, error=None):
+        with self.__lock:
+            self.latencies[operation].append(latency)
+            if error is not None:
+                self.errors[operation]['%s: %s' % (type(error).__name__, error)] += 1
+
+    def report(self, elapsed, out=sys.stdout):
+        rows = [(operation, latencies) for operation, latencies in sorted(self.latencies.items())]
+        rows.append(('total', [latency for _, latencies in rows for latency in latencies]))
+
+        out.write("%-32s %8s %8s %10s %9s %9s %9s\n" % ('operation', 'calls', 'errors', 'calls/s', 'p50 ms', 'p95 ms',
+                                                       'p99 ms'))
+        for operation, latencies in rows:
+            latencies = sorted(latencies)
+            if operation == 'total':
+                errors = sum(sum(errors.values()) for errors in self.errors.values())
+            else:
+                errors = sum(self.errors[operation].values())
+            out.write("%-32s %8d %7.1f%% %10.1f %9.2f %9.2f %9.2f\n" % (
+                operation, len(latencies), 100.0 * errors / len(latencies) if latencies else 0,
+                len(latencies) / elapsed, (percentile(latencies, 50) or 0) * 1000,
+                (percentile(latencies, 95) or 0) * 1000, (percentile(latencies, 99) or 0) * 1000))
+
+        for operation, errors in sorted(self.errors.items()):
+            for error, n in errors.most_common():
+                out.write("%s: %d x %s\n" % (operation, n, error))
+
+
+class LoadGenerator(object):
+    """
+    Makes calls chosen at random from a weighted mix of operations, until duration seconds have passed or
+    requests calls have been made
+    """
+
+    def __init__(self, client, options, mix, duration=None, requests=None):
+        self.client = client
+        self.options = options
+        self.duration = duration
+        self.requests = requests
+        self.stats = LoadStats()
+
+        self.__names = [name for name, _ in mix]
+        self.__cumulative_weights = []
+        total = 0
+        for _, weight in mix:
+            total += weight
+            self.__cumulative_weights.append(total)
+
+    def __choose(self):
+        return self.__names[bisect(self.__cumulative_weights, random.random() * self.__cumulative_weights[-1])]
+
+    def __call(self, scheduled_at=None):
+        operation = self.__choose()
+        start = scheduled_at or time.time()
+        try:
+            OPERATIONS[operation](self.client, self.options)
+        except Exception as e:
+            self.stats.record(operation, time.time() - start, e)
+        else:
+            self.stats.record(operation, time.time() - start)
+
+    def __schedule(self, interval=0):
+        """
+        Yield the times calls are due, every interval seconds (or now, without one), within the duration and number
+        of requests
+        """
+        start = time.time()
+        for n in count():
+            due = start + n * interval if interval else time.time()
+            if (self.requests is not None and n >= self.requests) or \
+                    (self.duration is not None and due - start >= self.duration):
+                return
+            yield due
+
+    def run_concurrency(self, concurrency):
+        """
+        Keep concurrency calls in flight until done, returning the elapsed time
+        """
+        schedule = self.__schedule()
+        lock = Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if next(schedule, None) is None:
+                        return
+                self.__call()
+
+        start = time.time()
+        workers = [Thread(target=worker) for _ in range(concurrency)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return time.time() - start
+
+    def run_rate(self, rate, max_workers):
+        """
+        Start rate calls per second, on up to max_workers threads, until done, returning the elapsed time
+        """
+        start = time.time()
+        with ThreadPoolExecutor(max_workers) as executor:
+            for due in self.__schedule(1.0 / rate):
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.__call, due)
+        return time.time() - start
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Generate load against the Mxit APIs (or a stand-in) and report on it')
+    parser.add_argument('--client-id', default=os.environ.get('MXIT_CLIENT_ID'))
+    parser.add_argument('--client-secret', default=os.environ.get('MXIT_CLIENT_SECRET'))
+    parser.add_argument('--api-endpoint', help='overrides settings.API_ENDPOINT')
+    parser.add_argument('--auth-endpoint', help='overrides settings.AUTH_ENDPOINT')
+    parser.add_argument('--stub', action='store_true', help='run against a local mxit.stub_server')
+    parser.add_argument('--stub-latency', type=float, default=0, help='seconds the stub server adds to responses')
+
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help='weighted operations, as name=weight,... (default: %s)' % DEFAULT_MIX)
+    parser.add_argument('--concurrency', type=int, default=10, help='calls in flight at once')
+    parser.add_argument('--rate', type=float, help='calls started per second, instead of a fixed concurrency')
+    parser.add_argument('--max-workers', type=int, default=200, help='threads available to --rate')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run for')
+    parser.add_argument('--requests', type=int, help='stop after this many calls, if that comes before the duration')
+
+    parser.add_argument('--app-id', default='loadtest', help='Mxit ID of the app messages are sent from')
+    parser.add_argument('--user-id', default='loadtest', help='user ID that messages and file offers are sent to')
+    parser.add_argument('--mxit-id', default='loadtest', help='Mxit ID that lookups are made for')
+    parser.add_argument('--message', default='Load test')
+    parser.add_argument('--payload-size', type=int, default=64 * 1024, help='bytes in uploaded files')
+    options = parser.parse_args(argv)
+
+    server = None
+    if options.stub:
+        from mxit.stub_server import StubServer
+        server = StubServer(latency=options.stub_latency).start()
+        options.api_endpoint = options.auth_endpoint = server.url
+        options.client_id = options.client_id or 'loadtest'
+        options.client_secret = options.client_secret or 'loadtest'
+
+    if not (options.client_id and options.client_secret):
+        parser.error('--client-id and --client-secret (or MXIT_CLIENT_ID and MXIT_CLIENT_SECRET) are required')
+
+    if options.api_endpoint:
+        settings.API_ENDPOINT = options.api_endpoint
+    if options.auth_endpoint:
+        settings.AUTH_ENDPOINT = options.auth_endpoint
+
+    options.payload = '\0' * options.payload_size
+
+    workers = options.max_workers if options.rate else options.concurrency
+    client = Mxit(options.client_id, options.client_secret, pool_maxsize=workers)
+    client.warm_up()
+
+    generator = LoadGenerator(client, options, options.mix, options.duration, options.requests)
+    try:
+        if options.rate:
+            elapsed = generator.run_rate(options.rate, options.max_workers)
+        else:
+            elapsed = generator.run_concurrency(options.concurrency)
+    finally:
+        client.close()
+        if server is not None:
+            server.stop()
+
+    generator.stats.report(elapsed)
+
+
+if __name__ == '__main__':
+    main()
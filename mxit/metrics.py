@@ -0,0 +1,201 @@
+from bisect import bisect_left
+from collections import Counter
+from fnmatch import fnmatch
+from threading import Lock
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Endpoints that requests are grouped under, most specific first, so that ids in paths don't each get their own
+# series. Paths matching none of them are grouped under 'other'.
+ENDPOINTS = (
+    '/token',
+    '/message/send',
+    '/user/lookup/*',
+    '/user/public/statusmessage/*',
+    '/user/public/displayname/*',
+    '/user/public/avatar/*',
+    '/user/statusmessage',
+    '/user/avatar',
+    '/user/profile',
+    '/user/profile/*',
+    '/user/socialgraph/contact/*',
+    '/user/socialgraph/contactlist',
+    '/user/socialgraph/suggestions',
+    '/user/cover',
+    '/user/media',
+    '/user/media/list/*',
+    '/user/media/content/*',
+    '/user/media/file/send',
+    '/user/media/file/send/*',
+    '/user/media/file/*',
+    '/user/media/*',
+)
+
+
+def endpoint_name(path):
+    """
+    The endpoint a request path is recorded under
+    """
+    for pattern in ENDPOINTS:
+        if fnmatch(path, pattern):
+            return pattern
+    return 'other'
+
+
+class Histogram(object):
+    """
+    Counts of observed values falling at or below each of the bucket upper bounds, with their sum
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        (upper bound, count of values at or below it) pairs, ending with an infinite bound
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(object):
+    """
+    Thread-safe record of the requests made through a transport
+
+    Keeps, per endpoint (see ENDPOINTS), a latency histogram and counts of responses by method and status,
+    request and response bytes, retries and connection errors, as well as counts of the OAuth tokens fetched.
+    Latencies span from the first attempt to the response body being read, including any retries.
+    """
+
+    def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        self.latency_buckets = latency_buckets
+
+        self.__lock = Lock()
+        self.__latency = {}
+        self.__responses = Counter()
+        self.__request_bytes = Counter()
+        self.__response_bytes = Counter()
+        self.__retries = Counter()
+        self.__errors = Counter()
+        self.__token_fetches = Counter()
+
+    def observe_request(self, endpoint, method, status_code, latency, request_bytes=0, response_bytes=0):
+        with self.__lock:
+            histogram = self.__latency.get((endpoint, method))
+            if histogram is None:
+                histogram = self.__latency[(endpoint, method)] = Histogram(self.latency_buckets)
+            histogram.observe(latency)
+
+            self.__responses[(endpoint, method, status_code)] += 1
+            self.__request_bytes[endpoint] += request_bytes
+            self.__response_bytes[endpoint] += response_bytes
+
+    def record_retry(self, endpoint):
+        with self.__lock:
+            self.__retries[endpoint] += 1
+
+    def record_error(self, endpoint):
+        """
+        Record a request that failed without a response, once its retries ran out
+        """
+        with self.__lock:
+            self.__errors[endpoint] += 1
+
+    def record_token_fetch(self, grant_type):
+        with self.__lock:
+            self.__token_fetches[grant_type] += 1
+
+    def snapshot(self):
+        """
+        A copy of the metrics as plain dictionaries
+        """
+        with self.__lock:
+            return {
+                'latency': dict(((endpoint, method), {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': histogram.cumulative(),
+                }) for (endpoint, method), histogram in self.__latency.items()),
+                'responses': dict(self.__responses),
+                'request_bytes': dict(self.__request_bytes),
+                'response_bytes': dict(self.__response_bytes),
+                'retries': dict(self.__retries),
+                'errors': dict(self.__errors),
+                'token_fetches': dict(self.__token_fetches),
+            }
+
+    def reset(self):
+        with self.__lock:
+            self.__latency.clear()
+            for counter in (self.__responses, self.__request_bytes, self.__response_bytes, self.__retries,
+                            self.__errors, self.__token_fetches):
+                counter.clear()
+
+    def to_prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format, to be served with the
+        'text/plain; version=0.0.4' content type
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        lines.append('# HELP mxit_request_duration_seconds Mxit API request latency, including retries')
+        lines.append('# TYPE mxit_request_duration_seconds histogram')
+        for (endpoint, method), histogram in sorted(snapshot['latency'].items()):
+            labels = {'endpoint': endpoint, 'method': method}
+            for bound, count in histogram['buckets']:
+                lines.append(_sample('mxit_request_duration_seconds_bucket', dict(labels, le=_format_value(bound)),
+                                     count))
+            lines.append(_sample('mxit_request_duration_seconds_sum', labels, histogram['sum']))
+            lines.append(_sample('mxit_request_duration_seconds_count', labels, histogram['count']))
+
+        lines.append('# HELP mxit_responses_total Mxit API responses by status code')
+        lines.append('# TYPE mxit_responses_total counter')
+        for (endpoint, method, status_code), count in sorted(snapshot['responses'].items()):
+            lines.append(_sample('mxit_responses_total',
+                                 {'endpoint': endpoint, 'method': method, 'code': status_code}, count))
+
+        for name, key, description in (
+                ('mxit_request_bytes_total', 'request_bytes', 'Bytes sent in Mxit API request bodies'),
+                ('mxit_response_bytes_total', 'response_bytes', 'Bytes received in Mxit API response bodies'),
+                ('mxit_retries_total', 'retries', 'Mxit API requests retried'),
+                ('mxit_request_errors_total', 'errors', 'Mxit API requests that failed without a response')):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s counter' % name)
+            for endpoint, count in sorted(snapshot[key].items()):
+                lines.append(_sample(name, {'endpoint': endpoint}, count))
+
+        lines.append('# HELP mxit_token_fetches_total OAuth tokens requested from the auth server')
+        lines.append('# TYPE mxit_token_fetches_total counter')
+        for grant_type, count in sorted(snapshot['token_fetches'].items()):
+            lines.append(_sample('mxit_token_fetches_total', {'grant_type': grant_type}, count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    return '%s{%s} %s' % (name, ','.join('%s="%s"' % (label, _escape(labels[label])) for label in sorted(labels)),
+                          _format_value(value))
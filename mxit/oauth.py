@@ -1,54 +1,183 @@
+import time
 import urllib
-from requests import post
+from collections import namedtuple
+from threading import RLock, Event, Thread
+from concurrent.futures import Future
 from requests.auth import HTTPBasicAuth
 from mxit import settings
 from mxit.exceptions import MxitAPIParameterException, MxitAPIException
+from mxit.tracing import span
+from mxit.transport import Transport
+
+# Tokens are treated as expired this many seconds early, so that they don't expire while a request is in flight
+EXPIRY_MARGIN = 30
+
+# With background refresh enabled, app tokens are refreshed this many seconds before they expire
+DEFAULT_REFRESH_AHEAD = 300
+
+# Seconds a token found in the shared cache is kept in memory for, when the cache can't tell its remaining lifetime
+PROMOTED_TOKEN_TTL = 60
+
+# Bounds on how long the background refresher sleeps between checks
+MIN_REFRESH_INTERVAL = 5
+MAX_REFRESH_INTERVAL = 60
+
+
+class _Token(namedtuple('_Token', ['access_token', 'scopes', 'expires_at', 'issued_at'])):
+    __slots__ = ()
+
+    def valid(self):
+        return self.expires_at is None or self.expires_at - EXPIRY_MARGIN > time.time()
+
+    def refresh_at(self, refresh_ahead):
+        """
+        When to refresh the token: refresh_ahead seconds before it expires, but no earlier than halfway through its
+        lifetime, so that tokens that don't outlive refresh_ahead aren't re-requested on every pass
+        """
+        return max(self.expires_at - refresh_ahead, (self.issued_at + self.expires_at) / 2.0)
 
 
 class OAuth():
     """
     Assists with retrieval of OAuth tokens
+
+    Tokens are kept in memory (L1) and, if a cache is given, in that shared cache (L2, see mxit.cache.Cache) so
+    that other processes can reuse them. Tokens found in the shared cache are promoted into memory.
     """
 
-    def __init__(self, client_id, client_secret, redirect_uri=None, state=None, cache=None, verify_cert=True):
+    def __init__(self, client_id, client_secret, redirect_uri=None, state=None, cache=None, verify_cert=True,
+                 transport=None, background_refresh=False, refresh_ahead=DEFAULT_REFRESH_AHEAD):
         self.__client_id = client_id
         self.__client_secret = client_secret
         self.__redirect_uri = redirect_uri
         self.__state = state
 
-        self.__user_token = None
-        self.__app_token = None
+        # Tokens by the scope string they were granted for
+        self.__user_token = {}
+        self.__app_token = {}
 
         self.__cache = cache
+        self.__cache_stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
         self.__verify_cert = verify_cert
+        self.__transport = transport or Transport()
+
+        # Token requests in flight, keyed by token type and scope, so concurrent callers can share them
+        self.__lock = RLock()
+        self.__pending = {}
+
+        # App tokens are refreshed ahead of expiry by a daemon thread, started with the first app token
+        self.__background_refresh = background_refresh
+        self.__refresh_ahead = refresh_ahead
+        self.__refresher = None
+        self.__stop_refresh = Event()
+
+    def __set_token(self, tokens, scope_string, token, expires_in, granted_scope):
+        issued_at = time.time()
+        expires_at = issued_at + expires_in if expires_in is not None else None
+        scopes = frozenset((granted_scope or scope_string).split())
+        with self.__lock:
+            tokens[scope_string] = _Token(token, scopes, expires_at, issued_at)
+
+    def __get_token(self, tokens, scope):
+        """
+        Find an unexpired token granted for all of the scopes in the scope string, in any order
+        """
+        with self.__lock:
+            candidates = tokens.values()
+
+        scopes = set(scope.split())
+        for token in candidates:
+            if token.valid() and token.scopes.issuperset(scopes):
+                return token.access_token
+        return None
 
-    def __set_user_token(self, scope_string, token):
-
-        if not self.__user_token:
-            self.__user_token = {}
-
-        self.__user_token[scope_string] = token
-        for scope in scope_string.split():
-            self.__user_token[scope] = token
+    def __set_user_token(self, scope_string, token, expires_in=None, granted_scope=None):
+        self.__set_token(self.__user_token, scope_string, token, expires_in, granted_scope)
 
     def __get_user_token(self, scope):
-        if self.__user_token and scope in self.__user_token:
-            return self.__user_token[scope]
-        return None
+        return self.__get_token(self.__user_token, scope)
 
-    def __set_app_token(self, scope_string, token):
+    def __set_app_token(self, scope_string, token, expires_in=None, granted_scope=None):
+        self.__set_token(self.__app_token, scope_string, token, expires_in, granted_scope)
 
-        if not self.__app_token:
-            self.__app_token = {}
-
-        self.__app_token[scope_string] = token
-        for scope in scope_string.split():
-            self.__app_token[scope] = token
+        if self.__background_refresh:
+            self.__start_refresher()
 
     def __get_app_token(self, scope):
-        if self.__app_token and scope in self.__app_token:
-            return self.__app_token[scope]
-        return None
+        return self.__get_token(self.__app_token, scope)
+
+    def __start_refresher(self):
+        with self.__lock:
+            if self.__refresher is None:
+                self.__refresher = Thread(target=self.__refresh_app_tokens, name='mxit-token-refresher')
+                self.__refresher.daemon = True
+                self.__refresher.start()
+
+    def __refresh_app_tokens(self):
+        """
+        Background loop re-requesting app tokens that are within refresh_ahead seconds of expiring (or past half
+        their lifetime, if that is later)
+        """
+        while True:
+            with self.__lock:
+                due = [(scope_string, token.refresh_at(self.__refresh_ahead) - time.time())
+                       for scope_string, token in self.__app_token.items() if token.expires_at is not None]
+
+            for scope_string, delay in due:
+                if delay <= 0:
+                    try:
+                        self.__single_flight(('app', scope_string), lambda: None,
+                                             lambda: self.__request_app_token(scope_string))
+                    except Exception:
+                        # Tried again on the next pass, request paths fetch it themselves once it has expired
+                        pass
+
+            interval = min([max(delay, MIN_REFRESH_INTERVAL) for _, delay in due] + [MAX_REFRESH_INTERVAL])
+            if self.__stop_refresh.wait(interval):
+                return
+
+    def stop_background_refresh(self):
+        """
+        Stop the background refresh of app tokens
+        """
+        self.__stop_refresh.set()
+
+    def __count(self, stat):
+        with self.__lock:
+            self.__cache_stats[stat] += 1
+
+    def cache_stats(self):
+        """
+        Number of token lookups served from memory (l1_hits), from the shared cache (l2_hits) or neither (misses)
+        """
+        with self.__lock:
+            return dict(self.__cache_stats)
+
+    def __get_cached_token(self, key):
+        """
+        Look the token up in the shared cache, along with how long it should be kept in memory for
+        """
+        if hasattr(self.__cache, 'get_with_ttl'):
+            token, ttl = self.__cache.get_with_ttl(key)
+        else:
+            token, ttl = self.__cache.get(key), None
+
+        if ttl is None:
+            return token, PROMOTED_TOKEN_TTL
+        # Tokens are only kept in the cache for as long as they are used from memory, see __set_cached_token
+        return token, ttl + EXPIRY_MARGIN
+
+    def __set_cached_token(self, key, token, expires_in):
+        """
+        Share the token through the shared cache until it is treated as expired in memory. Tokens without an
+        expiry aren't shared, as other processes couldn't tell when to stop using them
+        """
+        if self.__cache is not None and expires_in is not None:
+            self.__cache.set(key, str(token), max(expires_in - EXPIRY_MARGIN, 0))
+
+    def __record_token_fetch(self, grant_type):
+        if self.__transport.metrics is not None:
+            self.__transport.metrics.record_token_fetch(grant_type)
 
     def __user_token_cache_key(self, scope):
         return str("oauth_user_%s_%s" % (scope.replace("/", "_"), self.__client_id))
@@ -56,6 +185,37 @@ class OAuth():
     def __app_token_cache_key(self, scope):
         return str("oauth_app_%s_%s" % (scope.replace("/", "_"), self.__client_id))
 
+    def __single_flight(self, key, lookup, fetch):
+        """
+        Return lookup() if it finds a token, otherwise fetch() one. Concurrent calls for the same key wait for
+        the first caller's fetch and share its result (or exception) instead of each requesting a token
+        """
+        with self.__lock:
+            pending = self.__pending.get(key)
+            if pending is None:
+                token = lookup()
+                if token:
+                    return token
+
+                leader = True
+                pending = self.__pending[key] = Future()
+            else:
+                leader = False
+
+        if not leader:
+            return pending.result()
+
+        try:
+            token = fetch()
+            pending.set_result(token)
+            return token
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        finally:
+            with self.__lock:
+                del self.__pending[key]
+
     def auth_url(self, scope):
         """Gets the url a user needs to access to give up a user token"""
         params = {
@@ -73,20 +233,34 @@ class OAuth():
     def get_user_token(self, scope, code=None):
         """Gets the auth token from a user's response"""
 
-        user_token = self.__get_user_token(scope)
+        with span(self.__transport.tracer, 'token', grant_type='authorization_code', scope=scope) as s:
+            user_token = self.__get_user_token(scope)
+
+            if user_token:
+                self.__count('l1_hits')
+                s.set_attribute('source', 'memory')
+                return user_token
+
+            if self.__cache is not None:
+                token, ttl = self.__get_cached_token(self.__user_token_cache_key(scope))
+                if token:
+                    self.__count('l2_hits')
+                    s.set_attribute('source', 'cache')
+                    self.__set_user_token(scope, token, ttl)
+                    return token
 
-        if user_token:
-            return user_token
+            self.__count('misses')
 
-        if self.__cache is not None:
-            token = self.__cache.get(self.__user_token_cache_key())
-            if token:
-                return token
+            if self.__redirect_uri is None or code is None:
+                raise MxitAPIParameterException()
 
-        if self.__redirect_uri is None or code is None:
-            raise MxitAPIParameterException()
+            s.set_attribute('source', 'fetched')
+            return self.__single_flight(('user', scope), lambda: self.__get_user_token(scope),
+                                        lambda: self.__request_user_token(scope, code))
 
-        self.__user_token = None
+    def __request_user_token(self, scope, code):
+        with self.__lock:
+            self.__user_token.clear()
 
         payload = {
             'grant_type': 'authorization_code',
@@ -95,53 +269,59 @@ class OAuth():
         }
 
         url = settings.AUTH_ENDPOINT + '/token'
-        r = post(url, data=payload, auth=HTTPBasicAuth(self.__client_id, self.__client_secret), verify=self.__verify_cert)
+        self.__record_token_fetch(payload['grant_type'])
+        r = self.__transport.request('POST', url, data=payload, auth=HTTPBasicAuth(self.__client_id, self.__client_secret), verify=self.__verify_cert)
         if r.status_code == 200:
             data = r.json()
-            self.__set_user_token(scope, data[u'access_token'])
-            if self.__cache is not None:
-                self.__cache.set(self.__user_token_cache_key(scope), str(data[u'access_token']),
-                                 data[u'expires_in'] - 300)
-
-        user_token = self.__get_user_token(scope)
+            self.__set_user_token(scope, data[u'access_token'], data.get(u'expires_in'), data.get(u'scope'))
+            self.__set_cached_token(self.__user_token_cache_key(scope), data[u'access_token'], data.get(u'expires_in'))
 
-        if not user_token:
-            raise MxitAPIException("Failed to retrieve user token for '%s' scope" % scope)
+            # Returned directly, as a token granted with a very short expiry is already treated as expired
+            return data[u'access_token']
 
-        return user_token
+        raise MxitAPIException("Failed to retrieve user token for '%s' scope" % scope)
 
     def get_app_token(self, scope):
         """Gets the app auth token"""
 
-        app_token = self.__get_app_token(scope)
+        with span(self.__transport.tracer, 'token', grant_type='client_credentials', scope=scope) as s:
+            app_token = self.__get_app_token(scope)
+
+            if app_token:
+                self.__count('l1_hits')
+                s.set_attribute('source', 'memory')
+                return app_token
 
-        if app_token:
-            return app_token
+            if self.__cache is not None:
+                token, ttl = self.__get_cached_token(self.__app_token_cache_key(scope))
+                if token:
+                    self.__count('l2_hits')
+                    s.set_attribute('source', 'cache')
+                    self.__set_app_token(scope, token, ttl)
+                    return token
 
-        if self.__cache is not None:
-            token = self.__cache.get(self.__app_token_cache_key(scope))
-            if token:
-                return token
+            self.__count('misses')
 
-        self.__app_token = None
+            s.set_attribute('source', 'fetched')
+            return self.__single_flight(('app', scope), lambda: self.__get_app_token(scope),
+                                        lambda: self.__request_app_token(scope))
 
+    def __request_app_token(self, scope):
         payload = {
             'grant_type': 'client_credentials',
             'scope': scope
         }
 
+        # Requesting another client credentials token is harmless, so the request can be retried like a GET
         url = settings.AUTH_ENDPOINT + '/token'
-        r = post(url, data=payload, auth=HTTPBasicAuth(self.__client_id, self.__client_secret), verify=self.__verify_cert)
+        self.__record_token_fetch(payload['grant_type'])
+        r = self.__transport.request('POST', url, idempotent=True, data=payload, auth=HTTPBasicAuth(self.__client_id, self.__client_secret), verify=self.__verify_cert)
         if r.status_code == 200:
             data = r.json()
-            self.__set_app_token(scope, data[u'access_token'])
-            if self.__cache is not None:
-                self.__cache.set(self.__app_token_cache_key(scope), str(data[u'access_token']),
-                                 data[u'expires_in'] - 300)
-
-        app_token = self.__get_app_token(scope)
+            self.__set_app_token(scope, data[u'access_token'], data.get(u'expires_in'), data.get(u'scope'))
+            self.__set_cached_token(self.__app_token_cache_key(scope), data[u'access_token'], data.get(u'expires_in'))
 
-        if not app_token:
-            raise MxitAPIException("Failed to retrieve app token for '%s' scope" % scope)
+            # Returned directly, as a token granted with a very short expiry is already treated as expired
+            return data[u'access_token']
 
-        return app_token
+        raise MxitAPIException("Failed to retrieve app token for '%s' scope" % scope)
@@ -0,0 +1,301 @@
+"""
+Durable outbound message queue
+
+Messages put on an Outbox are written to a SQLite database and sent by a pool of background threads, so callers
+don't wait on the API and messages that haven't been sent when the process dies are sent once it is restarted.
+A message is only removed from the database after it has been sent, so delivery is at-least-once: a message whose
+send was in flight when the process died is sent again.
+"""
+import json
+import sqlite3
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+from mxit.exceptions import MxitAPIParameterException
+from mxit.retry import DEFAULT_RETRY_STATUSES
+from mxit.services import _status_code
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_RETRY_DELAY = 1
+DEFAULT_MAX_RETRY_DELAY = 300
+
+# Seconds idle senders wait before checking for messages whose retry delay has passed
+DEFAULT_POLL_INTERVAL = 1
+
+# Seconds over which the drain rate is measured
+DRAIN_RATE_WINDOW = 60
+
+PENDING = 'pending'
+SENDING = 'sending'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_available ON messages (state, available_at, id);
+"""
+
+
+def _is_retryable(error):
+    """
+    Whether a failed send may succeed if it is tried again later: anything but a bad argument or a request the
+    API rejected (a 4xx status other than 429)
+    """
+    if isinstance(error, (MxitAPIParameterException, TypeError, ValueError)):
+        return False
+    code = _status_code(error)
+    return code is None or code in DEFAULT_RETRY_STATUSES or code >= 500
+
+
+class Outbox(object):
+    """
+    Queue of messages to send with MessagingService.send_message, stored in the SQLite database at path
+
+    put() returns as soon as the message is stored. Once started, worker threads send the stored messages,
+    oldest first. Failed sends are retried (unless the API rejected the message with a 4xx status other than
+    429) up to max_attempts times, after a delay that doubles from retry_delay up to max_retry_delay seconds.
+    Messages that can't be sent are kept as failed, to be listed with failed_messages() and queued again with
+    retry_failed().
+
+    A database should only be used by one Outbox at a time: messages that were being sent when it was last
+    closed are queued again when it is opened.
+    """
+
+    def __init__(self, messaging, path, workers=DEFAULT_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retry_delay=DEFAULT_RETRY_DELAY, max_retry_delay=DEFAULT_MAX_RETRY_DELAY,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.messaging = messaging
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.poll_interval = poll_interval
+
+        self.__lock = Lock()
+        self.__wake = Event()
+        self.__stopping = Event()
+        self.__threads = []
+
+        self.__started_at = None
+        self.__sent = 0
+        self.__retried = 0
+        self.__sent_times = deque()
+
+        self.__db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.__lock:
+            self.__db.execute('PRAGMA journal_mode=WAL')
+            self.__db.executescript(SCHEMA)
+            self.__db.execute('UPDATE messages SET state = ? WHERE state = ?', (PENDING, SENDING))
+
+    def put(self, app_mxit_id, target_user_ids, message='', contains_markup=True, spool=None, spool_timeout=None,
+            links=None, scope='message/send'):
+        """
+        Store a message to be sent with MessagingService.send_message (taking the same arguments), returning its
+        id in the queue
+        """
+        return self.put_many([dict(app_mxit_id=app_mxit_id, target_user_ids=list(target_user_ids), message=message,
+                                   contains_markup=contains_markup, spool=spool, spool_timeout=spool_timeout,
+                                   links=links, scope=scope)])[0]
+
+    def put_many(self, messages):
+        """
+        Store many messages (dictionaries of send_message arguments) in a single transaction, returning their
+        ids in the queue
+        """
+        now = time.time()
+        ids = []
+        with self.__lock:
+            self.__db.execute('BEGIN IMMEDIATE')
+            try:
+                for message in messages:
+                    cursor = self.__db.execute(
+                        'INSERT INTO messages (message, state, created_at, available_at) VALUES (?, ?, ?, ?)',
+                        (json.dumps(message), PENDING, now, now))
+                    ids.append(cursor.lastrowid)
+            except:
+                self.__db.execute('ROLLBACK')
+                raise
+            self.__db.execute('COMMIT')
+
+        self.__wake.set()
+        return ids
+
+    def start(self):
+        """
+        Start the sender threads
+        """
+        if self.__threads:
+            return self
+
+        self.__stopping.clear()
+        self.__started_at = time.time()
+        self.__threads = [Thread(target=self.__run, name='mxit-outbox-%d' % i) for i in range(self.workers)]
+        for thread in self.__threads:
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stop the sender threads once they have finished the sends in flight
+        """
+        self.__stopping.set()
+        self.__wake.set()
+        for thread in self.__threads:
+            thread.join(timeout)
+        self.__threads = []
+
+    def close(self):
+        self.stop()
+        with self.__lock:
+            self.__db.close()
+
+    def drain(self, timeout=None):
+        """
+        Wait until every message has been sent or has failed, returning False if timeout seconds pass first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            counts = self.__counts()
+            if not counts.get(PENDING) and not counts.get(SENDING):
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(min(0.05, self.poll_interval))
+
+    def stats(self):
+        """
+        The number of messages pending, being sent and failed, the number sent and retried since the outbox was
+        started, the age in seconds of the oldest unsent message and the messages sent per second over the last
+        DRAIN_RATE_WINDOW seconds
+        """
+        counts = self.__counts()
+        with self.__lock:
+            oldest, = self.__db.execute('SELECT MIN(created_at) FROM messages WHERE state != ?',
+                                        (FAILED,)).fetchone()
+            now = time.time()
+            self.__trim_sent_times(now)
+            window = min(DRAIN_RATE_WINDOW, now - self.__started_at) if self.__started_at else 0
+            return {
+                'pending': counts.get(PENDING, 0),
+                'sending': counts.get(SENDING, 0),
+                'failed': counts.get(FAILED, 0),
+                'sent': self.__sent,
+                'retried': self.__retried,
+                'oldest_age': now - oldest if oldest is not None else 0,
+                'drain_rate': len(self.__sent_times) / window if window > 0 else 0.0,
+            }
+
+    def failed_messages(self):
+        """
+        (id, send_message arguments, attempts, last error) of each message that could not be sent
+        """
+        with self.__lock:
+            rows = self.__db.execute('SELECT id, message, attempts, last_error FROM messages WHERE state = ? '
+                                     'ORDER BY id', (FAILED,)).fetchall()
+        return [(id, json.loads(message), attempts, last_error) for id, message, attempts, last_error in rows]
+
+    def retry_failed(self, ids=None):
+        """
+        Queue failed messages (all of them, or those with the given ids) to be sent again, returning how many
+        """
+        now = time.time()
+        with self.__lock:
+            if ids is None:
+                cursor = self.__db.execute('UPDATE messages SET state = ?, attempts = 0, available_at = ? '
+                                           'WHERE state = ?', (PENDING, now, FAILED))
+            else:
+                cursor = self.__db.executemany('UPDATE messages SET state = ?, attempts = 0, available_at = ? '
+                                               'WHERE id = ? AND state = ?',
+                                               [(PENDING, now, id, FAILED) for id in ids])
+            count = cursor.rowcount
+
+        self.__wake.set()
+        return count
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __counts(self):
+        with self.__lock:
+            return dict(self.__db.execute('SELECT state, COUNT(*) FROM messages GROUP BY state').fetchall())
+
+    def __trim_sent_times(self, now):
+        while self.__sent_times and self.__sent_times[0] < now - DRAIN_RATE_WINDOW:
+            self.__sent_times.popleft()
+
+    def __claim(self):
+        """
+        Mark the oldest message that is due as being sent, returning its id, arguments and attempts so far
+        """
+        with self.__lock:
+            self.__db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.__db.execute('SELECT id, message, attempts FROM messages '
+                                        'WHERE state = ? AND available_at <= ? ORDER BY id LIMIT 1',
+                                        (PENDING, time.time())).fetchone()
+                if row is not None:
+                    self.__db.execute('UPDATE messages SET state = ? WHERE id = ?', (SENDING, row[0]))
+            except:
+                self.__db.execute('ROLLBACK')
+                raise
+            self.__db.execute('COMMIT')
+        return row
+
+    def __idle_time(self):
+        """
+        Seconds until the next pending message is due, up to poll_interval
+        """
+        with self.__lock:
+            due, = self.__db.execute('SELECT MIN(available_at) FROM messages WHERE state = ?', (PENDING,)).fetchone()
+        if due is None:
+            return self.poll_interval
+        return max(0, min(due - time.time(), self.poll_interval))
+
+    def __sent_message(self, id):
+        with self.__lock:
+            self.__db.execute('DELETE FROM messages WHERE id = ?', (id,))
+            now = time.time()
+            self.__sent += 1
+            self.__sent_times.append(now)
+            self.__trim_sent_times(now)
+
+    def __failed_message(self, id, attempts, error):
+        error_text = '%s: %s' % (type(error).__name__, error)
+        with self.__lock:
+            if _is_retryable(error) and attempts < self.max_attempts:
+                delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+                self.__db.execute('UPDATE messages SET state = ?, attempts = ?, available_at = ?, last_error = ? '
+                                  'WHERE id = ?', (PENDING, attempts, time.time() + delay, error_text, id))
+                self.__retried += 1
+            else:
+                self.__db.execute('UPDATE messages SET state = ?, attempts = ?, last_error = ? WHERE id = ?',
+                                  (FAILED, attempts, error_text, id))
+
+    def __run(self):
+        while not self.__stopping.is_set():
+            row = self.__claim()
+            if row is None:
+                self.__wake.wait(self.__idle_time())
+                self.__wake.clear()
+                continue
+
+            id, message, attempts = row
+            try:
+                self.messaging.send_message(**json.loads(message))
+            except Exception as e:
+                self.__failed_message(id, attempts + 1, e)
+            else:
+                self.__sent_message(id)
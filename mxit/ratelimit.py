@@ -0,0 +1,82 @@
+import time
+from fnmatch import fnmatch
+from threading import Lock
+from mxit.exceptions import MxitAPIRateLimitException
+
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average, and bursts of up to burst requests
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+
+        self.__tokens = self.burst
+        self.__updated = time.time()
+        self.__lock = Lock()
+
+    def reserve(self):
+        """
+        Take a token if one is available and return 0, otherwise return the seconds until one will be
+        """
+        with self.__lock:
+            now = time.time()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return 0
+            return (1 - self.__tokens) / self.rate
+
+
+class RateLimiter(object):
+    """
+    Client-side rate limiting of requests, per endpoint family
+
+    limits maps endpoint path patterns (e.g. '/message/send' or '/user/media/*') to (rate, burst) pairs; a
+    request counts against the most specific pattern matching its path, and requests matching none are not
+    limited. Once a family's burst is used up, requests either wait for their turn (block) or fail fast with
+    MxitAPIRateLimitException. max_wait bounds how long a blocked request waits before failing.
+    """
+
+    def __init__(self, limits, block=True, max_wait=None):
+        # Most specific (longest) patterns first
+        self.__buckets = [(pattern, TokenBucket(rate, burst))
+                          for pattern, (rate, burst) in sorted(limits.items(), key=lambda l: -len(l[0]))]
+        self.block = block
+        self.max_wait = max_wait
+
+    def __match(self, path):
+        for pattern, bucket in self.__buckets:
+            if fnmatch(path, pattern):
+                return pattern, bucket
+        return None, None
+
+    def family(self, path):
+        """
+        The pattern of the endpoint family a path belongs to, or None if it isn't limited
+        """
+        return self.__match(path)[0]
+
+    def acquire(self, path):
+        """
+        Wait for (or, if not blocking, check for) a free slot for a request to path
+        """
+        pattern, bucket = self.__match(path)
+        if bucket is None:
+            return
+
+        waited = 0
+        while True:
+            wait = bucket.reserve()
+            if not wait:
+                return
+
+            if not self.block or (self.max_wait is not None and waited + wait > self.max_wait):
+                raise MxitAPIRateLimitException("Rate limit reached for '%s'" % pattern)
+
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,100 @@
+import random
+import time
+from email.utils import parsedate_tz, mktime_tz
+from threading import Lock
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_MAX_BACKOFF = 30
+DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# Statuses that mean the request was not processed, so that even non-idempotent requests can be retried
+NOT_PROCESSED_STATUSES = (429,)
+
+
+class RetryBudget(object):
+    """
+    Caps retries at a fraction of the requests made through a client, so that retries don't pile onto an API
+    that is already failing
+
+    Every request deposits ratio into the budget (up to max_balance) and every retry withdraws one. The budget
+    starts with initial retries available.
+    """
+
+    def __init__(self, ratio=0.2, initial=10, max_balance=100):
+        self.ratio = ratio
+        self.max_balance = max_balance
+
+        self.__balance = float(initial)
+        self.__lock = Lock()
+
+    def deposit(self):
+        with self.__lock:
+            self.__balance = min(self.__balance + self.ratio, self.max_balance)
+
+    def withdraw(self):
+        """
+        Take one retry out of the budget, returning False if there is none left
+        """
+        with self.__lock:
+            if self.__balance < 1:
+                return False
+            self.__balance -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests are retried and how long to wait before each retry
+
+    Requests with idempotent methods are retried on connection errors and on any of retry_statuses; other
+    requests (e.g. POST /message/send) are only retried when the server reports that it did not process them
+    (429), since it can't be told whether a request that failed mid-way was delivered. Waits grow exponentially
+    from backoff_factor, with full jitter, up to max_backoff seconds; a Retry-After header from the server is
+    honoured instead when present. A retry is only made if the budget allows it.
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 max_backoff=DEFAULT_MAX_BACKOFF, retry_statuses=DEFAULT_RETRY_STATUSES,
+                 idempotent_methods=IDEMPOTENT_METHODS, budget=None):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.idempotent_methods = idempotent_methods
+        self.budget = budget or RetryBudget()
+
+    def is_idempotent(self, method):
+        return method.upper() in self.idempotent_methods
+
+    def should_retry_status(self, status_code, idempotent):
+        if idempotent:
+            return status_code in self.retry_statuses
+        return status_code in NOT_PROCESSED_STATUSES
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Seconds to wait before retry number attempt (starting at 0)
+        """
+        if retry_after is not None:
+            delay = _parse_retry_after(retry_after)
+            if delay is not None:
+                return min(delay, self.max_backoff)
+
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+
+def _parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either as a number of seconds or as an HTTP date
+    """
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, mktime_tz(parsed) - time.time())
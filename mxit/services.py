@@ -1,15 +1,61 @@
+import hashlib
 import json
+import mimetypes
+import mmap
+import os
+import time
 import urllib
-from requests import get, post, put, delete
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import islice
+from threading import Lock
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from mxit import settings
+from mxit.cache import _load_json, _save_json
 from mxit.exceptions import MxitAPIException
+from mxit.tracing import in_current_span, trace_calls
+from mxit.transport import Transport, _rewinder
+
+# Scopes the services request app (rather than user) tokens for
+APP_SCOPES = ('profile/public', 'message/send', 'content/send')
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_WORKERS = 10
+DEFAULT_PAGE_SIZE = 100
+
+# Name of the manifest kept in directories that gallery folders are mirrored to
+MIRROR_MANIFEST = '.mxit-gallery.json'
+
+# Name of the manifest kept in directories uploaded to the gallery, and how often (in seconds) it is saved
+UPLOAD_MANIFEST = '.mxit-upload.json'
+UPLOAD_CHECKPOINT_INTERVAL = 1
+
+# Local files starting with this are kept for the manifests, and not used for mirrored items
+RESERVED_FILE_PREFIX = '.mxit-'
+
+# Number of recipients broadcast_file_offer tries to upload the file with, before giving up
+BROADCAST_UPLOAD_ATTEMPTS = 3
+RESOLVE_FIELDS = ('user_id', 'display_name', 'status', 'basic_profile')
+
+# Seconds public profile lookups are cached for, per endpoint, when UserService is given a cache, and FileIds of
+# file offer uploads are kept for when it is given a file_id_cache
+DEFAULT_CACHE_TTLS = {
+    'user_id': 24 * 60 * 60,
+    'display_name': 60 * 60,
+    'status': 5 * 60,
+    'basic_profile': 60 * 60,
+    'avatar': 60 * 60,
+    'file_id': 24 * 60 * 60,
+}
 
 
 class BaseService():
-    def __init__(self, oauth):
+    def __init__(self, oauth, transport=None):
         self.oauth = oauth
+        self.transport = transport or Transport()
 
 
+@trace_calls('messaging')
 class MessagingService(BaseService):
     def send_message(self, app_mxit_id, target_user_ids, message='', contains_markup=True,
                      spool=None, spool_timeout=None, links=None, scope='message/send'):
@@ -32,17 +78,41 @@ class MessagingService(BaseService):
             data['Links'] = links
 
         return _post(
+            transport=self.transport,
             token=self.oauth.get_app_token(scope),
             uri='/message/send',
             data=data
         )
 
+    def broadcast_message(self, app_mxit_id, target_user_ids, message='', contains_markup=True,
+                          spool=None, spool_timeout=None, links=None, batch_size=DEFAULT_BATCH_SIZE,
+                          max_workers=DEFAULT_MAX_WORKERS, scope='message/send'):
+        """
+        Send a message (from a Mxit app) to a large list of Mxit users
+        The recipients are split into batches of batch_size which are sent concurrently, at most max_workers at
+        a time. Returns a BatchResult per batch, in order, so that only the batches that failed need to be resent
+        """
+        target_user_ids = list(target_user_ids)
+        batches = [target_user_ids[i:i + batch_size] for i in range(0, len(target_user_ids), batch_size)]
+
+        def send(batch):
+            try:
+                response = self.send_message(app_mxit_id, batch, message, contains_markup, spool, spool_timeout,
+                                             links, scope)
+                return BatchResult(batch, response, None)
+            except Exception as e:
+                return BatchResult(batch, None, e)
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            return list(executor.map(in_current_span(self.transport.tracer, send), batches))
+
     def send_user_to_user_message(self, from_user_id, target_user_ids, message='', contains_markup=True,
                                   scope='message/user'):
         """
         Send a message (from a Mxit user) to a list of Mxit users
         """
         return _post(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/message/send',
             data={
@@ -67,13 +137,53 @@ class MessagingService(BaseService):
         return data
 
 
+@trace_calls('users')
 class UserService(BaseService):
+    def __init__(self, oauth, transport=None, cache=None, cache_ttls=None, file_id_cache=None):
+        """
+        If a cache (such as mxit.cache.LRUCache) is given, public profile lookups are served from it for the
+        number of seconds configured per endpoint in cache_ttls (defaulting to DEFAULT_CACHE_TTLS)
+        If a file_id_cache (such as an LRUCache, or a FileCache to keep it across restarts) is given, the FileIds
+        of files uploaded for file offers are kept in it by content hash, for cache_ttls['file_id'] seconds
+        """
+        BaseService.__init__(self, oauth, transport)
+
+        self.cache = cache
+        self.cache_ttls = dict(DEFAULT_CACHE_TTLS, **(cache_ttls or {}))
+
+        self.file_id_cache = file_id_cache
+        self.__lock = Lock()
+        self.__pending_uploads = {}
+
+    def __cache_get(self, endpoint, key):
+        if self.cache is None:
+            return None
+        return self.cache.get((endpoint, key))
+
+    def __cache_set(self, endpoint, key, value):
+        if self.cache is not None:
+            self.cache.set((endpoint, key), value, self.cache_ttls[endpoint])
+        return value
+
+    def invalidate_cache(self, endpoint=None, key=None):
+        """
+        Drop cached lookups, either all of them or only those for an endpoint ('user_id', 'display_name',
+        'status', 'basic_profile' or 'avatar') and/or a key (the Mxit ID, or user ID for basic profiles)
+        """
+        if self.cache is not None:
+            self.cache.clear(lambda k: (endpoint is None or k[0] == endpoint) and (key is None or k[1] == key))
+
     def get_user_id(self, mxit_id, scope='profile/public'):
         """
         Retrieve the Mxit user's internal "user ID"
         No user authentication required
         """
+        cached = self.__cache_get('user_id', mxit_id)
+        if cached is not None:
+            return cached
+
         user_id = _get(
+            transport=self.transport,
             token=self.oauth.get_app_token(scope),
             uri='/user/lookup/' + urllib.quote(mxit_id)
         )
@@ -81,14 +191,19 @@ class UserService(BaseService):
         if user_id.startswith('"') and user_id.endswith('"'):
             user_id = user_id[1:-1]
 
-        return user_id
+        return self.__cache_set('user_id', mxit_id, user_id)
 
     def get_status(self, mxit_id, scope='profile/public'):
         """
         Retrieve the Mxit user's current status
         No user authentication required
         """
+        cached = self.__cache_get('status', mxit_id)
+        if cached is not None:
+            return cached
+
         status = _get(
+            transport=self.transport,
             token=self.oauth.get_app_token(scope),
             uri='/user/public/statusmessage/' + urllib.quote(mxit_id)
         )
@@ -96,25 +211,35 @@ class UserService(BaseService):
         if status.startswith('"') and status.endswith('"'):
             status = status[1:-1]
 
-        return status
+        return self.__cache_set('status', mxit_id, status)
 
     def set_status(self, message, scope='status/write'):
         """
         Set the Mxit user's status
         User authentication required with the following scope: 'status/write'
         """
-        return _put(
+        response = _put(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/statusmessage',
             data=message
         )
 
+        self.invalidate_cache('status')
+
+        return response
+
     def get_display_name(self, mxit_id, scope='profile/public'):
         """
         Retrieve the Mxit user's display name
         No user authentication required
         """
+        cached = self.__cache_get('display_name', mxit_id)
+        if cached is not None:
+            return cached
+
         display_name = _get(
+            transport=self.transport,
             token=self.oauth.get_app_token(scope),
             uri='/user/public/displayname/' + urllib.quote(mxit_id)
         )
@@ -122,75 +247,129 @@ class UserService(BaseService):
         if display_name.startswith('"') and display_name.endswith('"'):
             display_name = display_name[1:-1]
 
-        return display_name
+        return self.__cache_set('display_name', mxit_id, display_name)
 
-    def get_avatar(self, mxit_id, output_file_path=None, scope='profile/public'):
+    def get_avatar(self, mxit_id, output_file_path=None, scope='profile/public', output_file=None):
         """
         Retrieve the Mxit user's avatar
+        If output_file_path or a writable output_file is given, the avatar is streamed to it and the number of
+        bytes written is returned, otherwise the avatar data is returned
         No user authentication required
         """
+        if output_file_path or output_file is not None:
+            return _get_to_file(
+                transport=self.transport,
+                token=self.oauth.get_app_token(scope),
+                uri='/user/public/avatar/' + urllib.quote(mxit_id),
+                output_file_path=output_file_path,
+                output_file=output_file
+            )
+
+        cached = self.__cache_get('avatar', mxit_id)
+        if cached is not None:
+            return cached
+
         data = _get(
+            transport=self.transport,
             token=self.oauth.get_app_token(scope),
             uri='/user/public/avatar/' + urllib.quote(mxit_id)
         )
 
-        if output_file_path:
-            with open(output_file_path, 'w') as f:
-                f.write(data)
-        else:
-            return data
+        return self.__cache_set('avatar', mxit_id, data)
 
     def set_avatar(self, data=None, input_file_path=None, scope='avatar/write',
-                   content_type='application/octet-stream'):
+                   content_type='application/octet-stream', use_mmap=False):
         """
         Set the Mxit user's avatar
         User authentication required with the following scope: 'avatar/write'
         """
-        if input_file_path:
-            with open(input_file_path, 'rb') as f:
-                data = f.read()
+        with _upload_body(data, input_file_path, use_mmap) as body:
+            if not body:
+                raise ValueError('Either the data of an image file or the path to an image file must be provided')
 
-        if not data:
-            raise ValueError('Either the data of an image file or the path to an image file must be provided')
+            response = _post(
+                transport=self.transport,
+                token=self.oauth.get_user_token(scope),
+                uri='/user/avatar',
+                data=body,
+                content_type=content_type,
+            )
 
-        return _post(
-            token=self.oauth.get_user_token(scope),
-            uri='/user/avatar',
-            data=data,
-            content_type=content_type,
-        )
+        self.invalidate_cache('avatar')
+
+        return response
 
     def delete_avatar(self, scope='avatar/write'):
         """
         Delete the Mxit user's avatar
         User authentication required with the following scope: 'avatar/write'
         """
-        return _delete(
+        response = _delete(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/avatar'
         )
 
+        self.invalidate_cache('avatar')
+
+        return response
+
     def get_basic_profile(self, user_id, scope='profile/public'):
         """
         Retrieve the Mxit user's basic profile
         No user authentication required
         """
-        profile = _get(
-            token=self.oauth.get_app_token(scope),
-            uri='/user/profile/' + urllib.quote(user_id)
-        )
+        profile = self.__cache_get('basic_profile', user_id)
+
+        if profile is None:
+            profile = self.__cache_set('basic_profile', user_id, _get(
+                transport=self.transport,
+                token=self.oauth.get_app_token(scope),
+                uri='/user/profile/' + urllib.quote(user_id)
+            ))
 
         try:
             return json.loads(profile)
         except:
             raise MxitAPIException('Error parsing profile data')
 
+    def resolve_mxit_ids(self, mxit_ids, fields=('user_id', 'display_name', 'status'),
+                         max_workers=DEFAULT_MAX_WORKERS, scope='profile/public'):
+        """
+        Look up many Mxit users at once
+        The Mxit IDs are deduplicated and looked up concurrently, at most max_workers at a time. fields selects what
+        is retrieved for each user, out of RESOLVE_FIELDS. Yields a LookupResult per Mxit ID as soon as its lookups
+        complete, with the error raised for that ID (if any) instead of aborting the whole batch
+        No user authentication required
+        """
+        for field in fields:
+            if field not in RESOLVE_FIELDS:
+                raise ValueError("Unknown field '%s', expected one of %s" % (field, ', '.join(RESOLVE_FIELDS)))
+
+        def lookup(mxit_id):
+            values = {}
+            try:
+                if 'user_id' in fields or 'basic_profile' in fields:
+                    values['user_id'] = self.get_user_id(mxit_id, scope=scope)
+                if 'display_name' in fields:
+                    values['display_name'] = self.get_display_name(mxit_id, scope=scope)
+                if 'status' in fields:
+                    values['status'] = self.get_status(mxit_id, scope=scope)
+                if 'basic_profile' in fields:
+                    values['basic_profile'] = self.get_basic_profile(values['user_id'], scope=scope)
+                return LookupResult(mxit_id, values, None)
+            except Exception as e:
+                return LookupResult(mxit_id, values, e)
+
+        return _map_unordered(in_current_span(self.transport.tracer, lookup), _unique(mxit_ids), max_workers)
+
     def get_full_profile(self, scope='profile/private'):
         """
         Retrieve the Mxit user's full profile
         User authentication required with the following scope: 'profile/private'
         """
         profile = _get(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/profile'
         )
@@ -232,11 +411,15 @@ class UserService(BaseService):
 
         if data:
             _put(
+                transport=self.transport,
                 token=self.oauth.get_user_token(scope),
                 uri='/user/profile',
                 data=data
             )
 
+            self.invalidate_cache('display_name')
+            self.invalidate_cache('basic_profile')
+
     def add_contact(self, contact_id, scope='contact/invite'):
         """
         Add a contact
@@ -244,6 +427,7 @@ class UserService(BaseService):
         User authentication required with the following scope: 'contact/invite'
         """
         return _put(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/socialgraph/contact/' + urllib.quote(contact_id)
         )
@@ -256,12 +440,13 @@ class UserService(BaseService):
         params = {
             'filter': list_filter
         }
-        if skip:
+        if skip is not None:
             params['skip'] = skip
-        if count:
+        if count is not None:
             params['count'] = count
 
         contact_list = _get(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/socialgraph/contactlist?' + urllib.urlencode(params)
         )
@@ -271,12 +456,36 @@ class UserService(BaseService):
         except:
             raise MxitAPIException('Error parsing contact_list data')
 
+    def iter_contact_list(self, list_filter, page_size=DEFAULT_PAGE_SIZE, prefetch=True, scope='graph/read'):
+        """
+        Iterate over the Mxit user's whole contact list, fetching page_size contacts at a time
+        With prefetch, the next page is fetched in the background while the current one is being iterated over
+        User authentication required with the following scope: 'graph/read'
+        """
+        def fetch_page(skip):
+            return _page_items(self.get_contact_list(list_filter, skip, page_size, scope), 'Contacts')
+
+        return _paginate(in_current_span(self.transport.tracer, fetch_page), page_size, prefetch)
+
+    def get_contact_lists(self, list_filters, page_size=DEFAULT_PAGE_SIZE, max_workers=DEFAULT_MAX_WORKERS,
+                          scope='graph/read'):
+        """
+        Retrieve the Mxit user's whole contact list for several filters concurrently, at most max_workers at a time
+        Returns a dictionary of the contacts by filter
+        User authentication required with the following scope: 'graph/read'
+        """
+        def fetch(list_filter):
+            return list_filter, list(self.iter_contact_list(list_filter, page_size, prefetch=False, scope=scope))
+
+        return dict(_map_unordered(in_current_span(self.transport.tracer, fetch), _unique(list_filters), max_workers))
+
     def get_friend_suggestions(self, scope='graph/read'):
         """
         Retrieve the Mxit user's full profile
         User authentication required with the following scope: 'graph/read'
         """
         suggestions = _get(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/socialgraph/suggestions'
         )
@@ -292,6 +501,7 @@ class UserService(BaseService):
         User authentication required with the following scope: 'content/read'
         """
         folder_list = _get(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media'
         )
@@ -306,6 +516,7 @@ class UserService(BaseService):
         User authentication required with the following scope: 'content/write'
         """
         return _post(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media/' + urllib.quote(folder_name)
         )
@@ -316,6 +527,7 @@ class UserService(BaseService):
         User authentication required with the following scope: 'content/write'
         """
         return _delete(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media/' + urllib.quote(folder_name)
         )
@@ -326,6 +538,7 @@ class UserService(BaseService):
         User authentication required with the following scope: 'content/write'
         """
         return _put(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media/' + urllib.quote(old_folder_name),
             data=new_folder_name
@@ -337,6 +550,7 @@ class UserService(BaseService):
         User authentication required with the following scope: 'content/write'
         """
         return _delete(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media/file/' + urllib.quote(file_id)
         )
@@ -347,35 +561,111 @@ class UserService(BaseService):
         User authentication required with the following scope: 'content/write'
         """
         return _put(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media/file/' + urllib.quote(file_id),
             data=new_file_name
         )
 
     def upload_gallery_file(self, folder_name, file_name, data=None, input_file_path=None,
-                            prevent_share=False, content_type="image/png", scope='content/write'):
+                            prevent_share=False, content_type="image/png", scope='content/write', use_mmap=False):
         """
         Upload a file to a folder in the Mxit user's gallery
         User authentication required with the following scope: 'content/write'
         """
-        if input_file_path:
-            with open(input_file_path, 'rb') as f:
-                data = f.read()
+        with _upload_body(data, input_file_path, use_mmap) as body:
+            if not body:
+                raise ValueError('Either the data of a file or the path to a file must be provided')
 
-        if not data:
-            raise ValueError('Either the data of a file or the path to a file must be provided')
+            params = {
+                'fileName': file_name,
+                'preventShare': 'true' if prevent_share else 'false',
+            }
 
-        params = {
-            'fileName': file_name,
-            'preventShare': 'true' if prevent_share else 'false',
-        }
+            return _post(
+                transport=self.transport,
+                token=self.oauth.get_user_token(scope),
+                uri='/user/media/file/' + urllib.quote(folder_name) + '?' + urllib.urlencode(params),
+                data=body,
+                content_type=content_type,
+            )
 
-        return _post(
-            token=self.oauth.get_user_token(scope),
-            uri='/user/media/file/' + urllib.quote(folder_name) + '?' + urllib.urlencode(params),
-            data=data,
-            content_type=content_type,
-        )
+    def upload_gallery_files(self, folder_name, files, manifest_path=None, max_workers=DEFAULT_MAX_WORKERS,
+                             create_folder=True, prevent_share=False, content_type=None, scope='content/write',
+                             use_mmap=False):
+        """
+        Upload many files to a folder in the Mxit user's gallery, at most max_workers at a time
+        files is either a directory, whose (non-hidden) files are all uploaded, or a list of file paths. The folder is
+        created first if create_folder is set. Uploaded files are recorded in the manifest at manifest_path (by
+        default, in the directory uploaded), so that running the job again skips the files already uploaded, unless
+        they have changed since. The content type of each file is guessed from its name unless content_type is
+        given. Returns an UploadResult, with the errors of files that couldn't be read or uploaded in failed
+        User authentication required with the following scope: 'content/write'
+        """
+        if isinstance(files, basestring):
+            if manifest_path is None:
+                manifest_path = os.path.join(files, UPLOAD_MANIFEST)
+            files = sorted(os.path.join(files, name) for name in os.listdir(files)
+                           if not name.startswith('.') and os.path.isfile(os.path.join(files, name)))
+
+        manifest = _load_json(manifest_path) if manifest_path else {}
+        entries = manifest.get('files', {}) if manifest.get('folder') == folder_name else {}
+
+        pending = []
+        skipped = 0
+        failed = {}
+        for path in files:
+            key = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                failed[path] = e
+                continue
+            entry = entries.get(key)
+            if entry is not None and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime):
+                skipped += 1
+            else:
+                pending.append((path, key, stat))
+
+        if create_folder and pending:
+            try:
+                self.create_gallery_folder(folder_name, scope)
+            except MxitAPIException:
+                # The folder already exists, any other problem with it fails the uploads
+                pass
+
+        def upload(pending_file):
+            path = pending_file[0]
+            try:
+                response = self.upload_gallery_file(folder_name, os.path.basename(path), input_file_path=path,
+                                                    prevent_share=prevent_share,
+                                                    content_type=content_type or _guess_content_type(path),
+                                                    scope=scope, use_mmap=use_mmap)
+                return pending_file, _file_id(response), None
+            except Exception as e:
+                return pending_file, None, e
+
+        upload = in_current_span(self.transport.tracer, upload)
+        uploaded, total_bytes = {}, 0
+        started_at = saved_at = time.time()
+        try:
+            for (path, key, stat), file_id, error in _map_unordered(upload, pending, max_workers):
+                if error is not None:
+                    failed[path] = error
+                    continue
+
+                uploaded[path] = file_id
+                total_bytes += stat.st_size
+                entries[key] = {'file_id': file_id, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+                if manifest_path and time.time() - saved_at >= UPLOAD_CHECKPOINT_INTERVAL:
+                    _save_json(manifest_path, {'folder': folder_name, 'files': entries})
+                    saved_at = time.time()
+        finally:
+            if manifest_path:
+                _save_json(manifest_path, {'folder': folder_name, 'files': entries})
+
+        return UploadResult(uploaded, skipped, failed, total_bytes, time.time() - started_at)
 
     def get_gallery_item_list(self, folder_name, skip=None, count=None, scope='content/read'):
         """
@@ -384,14 +674,15 @@ class UserService(BaseService):
         """
 
         params = {}
-        if skip:
+        if skip is not None:
             params['skip'] = skip
-        if count:
+        if count is not None:
             params['count'] = count
 
         qs = '?' + urllib.urlencode(params) if params else ''
 
         folder_item_list = _get(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media/list/' + urllib.quote(folder_name) + qs
         )
@@ -400,49 +691,252 @@ class UserService(BaseService):
         except:
             raise MxitAPIException('Error parsing gallery folder list')
 
-    def get_gallery_file(self, file_id, output_file_path=None, scope='content/read'):
+    def iter_gallery_items(self, folder_name, page_size=DEFAULT_PAGE_SIZE, prefetch=True, scope='content/read'):
+        """
+        Iterate over all of the items in a given folder in the Mxit user's gallery, fetching page_size at a time
+        With prefetch, the next page is fetched in the background while the current one is being iterated over
+        User authentication required with the following scope: 'content/read'
+        """
+        def fetch_page(skip):
+            return _page_items(self.get_gallery_item_list(folder_name, skip, page_size, scope), 'Items')
+
+        return _paginate(in_current_span(self.transport.tracer, fetch_page), page_size, prefetch)
+
+    def walk_gallery(self, folder_names=None, page_size=DEFAULT_PAGE_SIZE, max_workers=DEFAULT_MAX_WORKERS,
+                     scope='content/read'):
+        """
+        Iterate over the items in several folders in the Mxit user's gallery (by default, all of them) as
+        (folder name, item) pairs, listing at most max_workers folders concurrently. The items of each folder are
+        yielded together, in the order the folders finish listing
+        User authentication required with the following scope: 'content/read'
+        """
+        if folder_names is None:
+            folder_names = _page_items(self.get_gallery_folder_list(scope), 'Folders')
+
+        def list_folder(folder_name):
+            return folder_name, list(self.iter_gallery_items(folder_name, page_size, prefetch=False, scope=scope))
+
+        list_folder = in_current_span(self.transport.tracer, list_folder)
+        for folder_name, items in _map_unordered(list_folder, _unique(folder_names), max_workers):
+            for item in items:
+                yield folder_name, item
+
+    def mirror_gallery_folder(self, folder_name, local_dir, max_workers=DEFAULT_MAX_WORKERS, delete=True,
+                              page_size=DEFAULT_PAGE_SIZE, scope='content/read'):
+        """
+        Mirror a folder in the Mxit user's gallery into local_dir
+        A manifest of the file IDs and sizes mirrored is kept in local_dir, so that only items that are new, have
+        changed size or are missing locally are downloaded, streamed to disk at most max_workers at a time. With
+        delete, local copies of items deleted from the folder are removed. Items keep the local file name they were
+        first downloaded as. Returns a MirrorResult, with the items that failed to download in failed
+        User authentication required with the following scope: 'content/read'
+        """
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+
+        manifest_path = os.path.join(local_dir, MIRROR_MANIFEST)
+        mirrored = _load_json(manifest_path).get('files', {})
+        items = dict((item['FileId'], item)
+                     for item in self.iter_gallery_items(folder_name, page_size, scope=scope))
+
+        deleted = [file_id for file_id in mirrored if file_id not in items]
+        if delete:
+            for file_id in deleted:
+                _remove(os.path.join(local_dir, mirrored.pop(file_id)['name']))
+
+        taken = set(entry['name'] for entry in mirrored.values())
+        downloads = []
+        unchanged = 0
+        for file_id, item in items.items():
+            entry = mirrored.get(file_id)
+            if entry is not None and _is_mirrored(os.path.join(local_dir, entry['name']), entry, item):
+                unchanged += 1
+                continue
+
+            if entry is None:
+                entry = {'name': _local_file_name(file_id, item.get('FileName'), taken)}
+                taken.add(entry['name'])
+            downloads.append((file_id, entry['name']))
+
+        def download(download):
+            file_id, name = download
+            path = os.path.join(local_dir, name)
+            try:
+                # Written next to the final path and moved into place once complete
+                size = self.get_gallery_file(file_id, output_file_path=path + '.part', scope=scope)
+                os.rename(path + '.part', path)
+                return file_id, name, size, None
+            except Exception as e:
+                _remove(path + '.part')
+                return file_id, name, None, e
+
+        download = in_current_span(self.transport.tracer, download)
+        downloaded, failed, total_bytes = [], {}, 0
+        try:
+            for file_id, name, size, error in _map_unordered(download, downloads, max_workers):
+                if error is not None:
+                    failed[file_id] = error
+                    continue
+
+                mirrored[file_id] = {'name': name, 'size': size}
+                downloaded.append(file_id)
+                total_bytes += size
+        finally:
+            _save_json(manifest_path, {'folder': folder_name, 'files': mirrored})
+
+        return MirrorResult(downloaded, unchanged, deleted if delete else [], failed, total_bytes)
+
+    def get_gallery_file(self, file_id, output_file_path=None, scope='content/read', output_file=None):
         """
         Get a file in the Mxit user's gallery
+        If output_file_path or a writable output_file is given, the file is streamed to it and the number of
+        bytes written is returned, otherwise the file data is returned
         User authentication required with the following scope: 'content/read'
         """
-        data = _get(
+        if output_file_path or output_file is not None:
+            return _get_to_file(
+                transport=self.transport,
+                token=self.oauth.get_user_token(scope),
+                uri='/user/media/content/' + urllib.quote(file_id),
+                output_file_path=output_file_path,
+                output_file=output_file
+            )
+
+        return _get(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/media/content/' + urllib.quote(file_id)
         )
 
-        if output_file_path:
-            with open(output_file_path, 'w') as f:
-                f.write(data)
-        else:
-            return data
-
     def upload_file_and_send_file_offer(self, file_name, user_id, data=None, input_file_path=None,
                                         content_type='application/octet-stream', auto_open=False,
-                                        prevent_share=False, scope='content/send'):
+                                        prevent_share=False, scope='content/send', use_mmap=False):
         """
         Upload a file of any type to store and return a FileId once file offer has been sent.
+        If the service has a file_id_cache, content is only uploaded once (per file name and content type): later
+        offers of identical content are sent with send_file_offer, reusing the FileId of the first upload
         No user authentication required
         """
-        if input_file_path:
-            with open(input_file_path, 'rb') as f:
-                data = f.read()
-
-        if not data:
-            raise ValueError('Either the data of a file or the path to a file must be provided')
-
-        params = {
-            'fileName': file_name,
-            'userId': user_id,
-            'autoOpen': 'true' if auto_open else 'false',
-            'preventShare': 'true' if prevent_share else 'false',
-        }
+        key = None
+        if self.file_id_cache is not None:
+            key = _file_offer_key(data, input_file_path, file_name, content_type, self.transport.chunk_size)
+
+        def upload():
+            return self.__upload_file_and_send_file_offer(file_name, user_id, data, input_file_path, content_type,
+                                                          auto_open, prevent_share, scope, use_mmap)
+
+        if key is None:
+            return upload()
+
+        while True:
+            # The cache is checked under the lock, so that an upload can't finish unseen between the two checks
+            with self.__lock:
+                response = self.file_id_cache.get(key)
+                pending = self.__pending_uploads.get(key)
+                leader = response is None and pending is None
+                if leader:
+                    pending = self.__pending_uploads[key] = Future()
+
+            if leader:
+                # Concurrent offers of the same content wait for this upload instead of making their own
+                try:
+                    response = upload()
+                    self.file_id_cache.set(key, response, self.cache_ttls['file_id'])
+                    pending.set_result(response)
+                    return response
+                except Exception as e:
+                    pending.set_exception(e)
+                    raise
+                finally:
+                    with self.__lock:
+                        del self.__pending_uploads[key]
+
+            if response is None:
+                try:
+                    response = pending.result()
+                except Exception:
+                    # The upload may have failed because of its recipient, so the next offer takes over uploading
+                    continue
+
+            try:
+                self.send_file_offer(_file_id(response), user_id, auto_open, scope)
+                return response
+            except MxitAPIException as e:
+                # Only an expired upload is uploaded again; other failures (such as an unknown recipient) would fail
+                # the upload as well
+                if _status_code(e) != 404:
+                    raise
+                with self.__lock:
+                    if self.file_id_cache.get(key) == response:
+                        self.file_id_cache.delete(key)
+
+    def broadcast_file_offer(self, file_name, user_ids, data=None, input_file_path=None,
+                             content_type='application/octet-stream', auto_open=False, prevent_share=False,
+                             file_id=None, max_workers=DEFAULT_MAX_WORKERS, scope='content/send', use_mmap=False):
+        """
+        Offer a file to a large list of users, uploading it only once
+        The file is uploaded with the offer to the first user (or, if that fails, one of the next few), then offered
+        to the rest with send_file_offer, at most max_workers at a time. Returns an OfferResult per user, in order.
+        The users that failed can be retried by passing them back in along with the file_id of a successful result,
+        which skips the upload
+        No user authentication required
+        """
+        user_ids = list(_unique(user_ids))
+        results = {}
+
+        if file_id is None:
+            # Iterators can't be read again to retry the upload with another user
+            rewind = _rewinder(data)
+            attempts = BROADCAST_UPLOAD_ATTEMPTS if rewind is not None else 1
+
+            for user_id in user_ids[:attempts]:
+                try:
+                    file_id = _file_id(self.upload_file_and_send_file_offer(
+                        file_name, user_id, data, input_file_path, content_type, auto_open, prevent_share, scope,
+                        use_mmap))
+                    results[user_id] = OfferResult(user_id, file_id, None)
+                    break
+                except Exception as e:
+                    results[user_id] = OfferResult(user_id, None, e)
+                    if rewind is not None:
+                        rewind()
+            else:
+                error = MxitAPIException('The file could not be uploaded')
+                return [results.get(user_id) or OfferResult(user_id, None, error) for user_id in user_ids]
+
+        def offer(user_id):
+            try:
+                self.send_file_offer(file_id, user_id, auto_open, scope)
+                return OfferResult(user_id, file_id, None)
+            except Exception as e:
+                return OfferResult(user_id, file_id, e)
+
+        remaining = [user_id for user_id in user_ids if user_id not in results]
+        with ThreadPoolExecutor(max_workers) as executor:
+            results.update(zip(remaining, executor.map(in_current_span(self.transport.tracer, offer), remaining)))
+
+        return [results[user_id] for user_id in user_ids]
+
+    def __upload_file_and_send_file_offer(self, file_name, user_id, data, input_file_path, content_type, auto_open,
+                                          prevent_share, scope, use_mmap):
+        with _upload_body(data, input_file_path, use_mmap) as body:
+            if not body:
+                raise ValueError('Either the data of a file or the path to a file must be provided')
+
+            params = {
+                'fileName': file_name,
+                'userId': user_id,
+                'autoOpen': 'true' if auto_open else 'false',
+                'preventShare': 'true' if prevent_share else 'false',
+            }
 
-        return _post(
-            token=self.oauth.get_app_token(scope),
-            uri='/user/media/file/send?' + urllib.urlencode(params),
-            data=data,
-            content_type=content_type
-        )
+            return _post(
+                transport=self.transport,
+                token=self.oauth.get_app_token(scope),
+                uri='/user/media/file/send?' + urllib.urlencode(params),
+                data=body,
+                content_type=content_type
+            )
 
     def send_file_offer(self, file_id, user_id, auto_open=False, scope='content/send'):
         """
@@ -456,49 +950,258 @@ class UserService(BaseService):
         }
 
         return _post(
+            transport=self.transport,
             token=self.oauth.get_app_token(scope),
             uri='/user/media/file/send/' + urllib.quote(file_id) + '?' + urllib.urlencode(params)
         )
 
-    def get_cover_image(self, output_file_path=None, scope='profile/public'):
+    def get_cover_image(self, output_file_path=None, scope='profile/public', output_file=None):
         """
         Retrieve the Mxit user's cover image
+        If output_file_path or a writable output_file is given, the cover image is streamed to it and the number of
+        bytes written is returned, otherwise the cover image data is returned
         No user authentication required
         """
-        data = _get(
+        if output_file_path or output_file is not None:
+            return _get_to_file(
+                transport=self.transport,
+                token=self.oauth.get_user_token(scope),
+                uri='/user/cover',
+                output_file_path=output_file_path,
+                output_file=output_file
+            )
+
+        return _get(
+            transport=self.transport,
             token=self.oauth.get_user_token(scope),
             uri='/user/cover'
         )
 
-        if output_file_path:
-            with open(output_file_path, 'w') as f:
-                f.write(data)
-        else:
-            return data
-
     def set_cover_image(self, data=None, input_file_path=None, scope='avatar/write',
-                        content_type='application/octet-stream'):
+                        content_type='application/octet-stream', use_mmap=False):
         """
         Set the Mxit user's cover image
         User authentication required with the following scope: 'avatar/write' (cover image and avatars are treated the same)
         """
-        if input_file_path:
-            with open(input_file_path, 'rb') as f:
-                data = f.read()
-
-        if not data:
-            raise ValueError('Either the data of an image file or the path to an image file must be provided')
+        with _upload_body(data, input_file_path, use_mmap) as body:
+            if not body:
+                raise ValueError('Either the data of an image file or the path to an image file must be provided')
 
-        return _post(
-            token=self.oauth.get_user_token(scope),
-            uri='/user/cover',
-            data=data,
-            content_type=content_type,
-            )
+            return _post(
+                transport=self.transport,
+                token=self.oauth.get_user_token(scope),
+                uri='/user/cover',
+                data=body,
+                content_type=content_type,
+                )
 
 
 # Helpers
 
+class BatchResult(namedtuple('BatchResult', ['user_ids', 'response', 'error'])):
+    """
+    Outcome of sending to one batch of users: the API response, or the exception raised if it failed
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class LookupResult(namedtuple('LookupResult', ['mxit_id', 'values', 'error'])):
+    """
+    Outcome of looking up one Mxit ID: the values retrieved by field name, or the exception raised if it failed
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class MirrorResult(namedtuple('MirrorResult', ['downloaded', 'unchanged', 'deleted', 'failed', 'bytes'])):
+    """
+    Outcome of mirroring a gallery folder: the IDs of the files downloaded and deleted locally, the number
+    already up to date, the exception raised by file ID for those that failed to download, and the bytes
+    downloaded
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return not self.failed
+
+
+class OfferResult(namedtuple('OfferResult', ['user_id', 'file_id', 'error'])):
+    """
+    Outcome of offering a file to one user: the FileId offered, and the exception raised if the offer failed
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class UploadResult(namedtuple('UploadResult', ['uploaded', 'skipped', 'failed', 'bytes', 'elapsed'])):
+    """
+    Outcome of a bulk upload: the FileId of each file uploaded by path, the number skipped as already uploaded,
+    the exception raised by path for those that failed, the bytes uploaded and the seconds taken
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def files_per_second(self):
+        return len(self.uploaded) / self.elapsed if self.elapsed else 0.0
+
+
+def _unique(items):
+    """
+    Yield each distinct item once, in the order first seen
+    """
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
+def _map_unordered(fn, items, max_workers):
+    """
+    Yield fn(item) for each item as soon as it completes, with at most max_workers calls in flight
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers) as executor:
+        pending = set(executor.submit(fn, item) for item in islice(items, max_workers))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for item in islice(items, 1):
+                    pending.add(executor.submit(fn, item))
+                yield future.result()
+
+
+def _page_items(page, key):
+    """
+    The items in a page of a listing, which are either the page itself or under key
+    """
+    if isinstance(page, dict):
+        return page.get(key) or []
+    return page or []
+
+
+def _paginate(fetch_page, page_size, prefetch=True):
+    """
+    Yield the items of the pages returned by fetch_page(skip) in turn, until a page comes back short
+    With prefetch, the next page is fetched on a background thread while the current one is being consumed
+    """
+    executor = ThreadPoolExecutor(1) if prefetch else None
+    try:
+        skip = 0
+        items = fetch_page(skip)
+        while True:
+            skip += page_size
+            last = len(items) < page_size
+            if not last and executor is not None:
+                next_page = executor.submit(fetch_page, skip)
+
+            for item in items:
+                yield item
+
+            if last:
+                return
+            items = next_page.result() if executor is not None else fetch_page(skip)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def _status_code(error):
+    """
+    The HTTP status code an MxitAPIException was raised for, if any
+    """
+    details = error.args[1] if len(error.args) > 1 and isinstance(error.args[1], dict) else {}
+    return details.get('code')
+
+
+def _file_id(response):
+    """
+    The FileId returned by an upload, as a JSON string
+    """
+    try:
+        return json.loads(response)
+    except ValueError:
+        return response
+
+
+def _file_offer_key(data, input_file_path, file_name, content_type, chunk_size):
+    """
+    Key of an upload for a file offer in the FileId cache: a SHA-256 of its file name, content type and content,
+    or None if the content is an iterator, which can only be read once
+    """
+    digest = hashlib.sha256(json.dumps([file_name, content_type]))
+
+    if input_file_path:
+        with open(input_file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                digest.update(chunk)
+    elif isinstance(data, basestring):
+        digest.update(data)
+    elif hasattr(data, 'read') and hasattr(data, 'seek'):
+        position = data.tell()
+        for chunk in iter(lambda: data.read(chunk_size), ''):
+            digest.update(chunk)
+        data.seek(position)
+    else:
+        return None
+
+    return 'file_offer_' + digest.hexdigest()
+
+
+def _guess_content_type(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _is_mirrored(path, entry, item):
+    """
+    Whether the local copy at path of a gallery item, recorded in the manifest as entry, is up to date
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    return size == entry['size'] and item.get('Size') in (None, entry['size'])
+
+
+def _local_file_name(file_id, file_name, taken):
+    """
+    A local file name for a gallery item that doesn't clash with those taken, or escape the directory
+    Items named '.' or '..', or like the manifests and their temporary files, are named after their file ID instead
+    """
+    name = os.path.basename(file_name or '')
+    if name in ('', os.curdir, os.pardir) or name.startswith(RESERVED_FILE_PREFIX):
+        name = file_id
+    if name in taken:
+        name = '%s-%s' % (file_id, name)
+    return name
+
+
 CONTACT_LIST_FILTER = {
     'all': '@All',
     'friends': '@Friends',
@@ -512,18 +1215,57 @@ CONTACT_LIST_FILTER = {
 }
 
 
-def _get(token, uri, content_type='application/json', api_endpoint=settings.API_ENDPOINT):
+@contextmanager
+def _upload_body(data=None, input_file_path=None, use_mmap=False):
+    """
+    Yield a request body that is streamed rather than read into memory: the file at input_file_path (or a
+    read-only memory map of it if use_mmap is set), otherwise data itself, which can be a string, a readable
+    file object or an iterator of chunks
+    """
+    if not input_file_path:
+        yield data
+        return
+
+    # An empty file is no body at all, as it was when files were read into memory (and can't be memory mapped)
+    if not os.path.getsize(input_file_path):
+        yield ''
+        return
+
+    with open(input_file_path, 'rb') as f:
+        if not use_mmap:
+            yield f
+            return
+
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+def _is_streamed(data):
+    """
+    Whether data is a body that is sent as it is, rather than a value to encode: a readable file object (or memory
+    map) or an iterator of chunks
+    """
+    return hasattr(data, 'read') or (hasattr(data, '__iter__') and not isinstance(data, (dict, list, tuple)))
+
+
+def _api_url(uri, api_endpoint=None):
+    # settings.API_ENDPOINT is looked up on every call, so that it can be pointed elsewhere at runtime
+    return (api_endpoint or settings.API_ENDPOINT) + uri
+
+
+def _get(transport, token, uri, content_type='application/json', api_endpoint=None):
     headers = {
         'Content-Type': content_type,
         'Accept': content_type,
         'Authorization': 'Bearer ' + token
     }
 
-    r = get(api_endpoint + uri, headers=headers)
+    r = transport.request('GET', _api_url(uri, api_endpoint), headers=headers, stream=True)
 
-    response = ''
-    for chunk in r.iter_content():
-        response += chunk
+    response = transport.read_body(r)
 
     if r.status_code != 200:
         raise MxitAPIException("Unexpected HTTP Status: %s" % r.status_code,
@@ -532,21 +1274,45 @@ def _get(token, uri, content_type='application/json', api_endpoint=settings.API_
     return response
 
 
-def _post(token, uri, data={}, content_type='application/json', api_endpoint=settings.API_ENDPOINT):
+def _get_to_file(transport, token, uri, output_file_path=None, output_file=None, content_type='application/json',
+                 api_endpoint=None):
+    """
+    GET the uri and stream the response body to output_file_path (or the writable output_file) as it arrives,
+    holding at most one chunk in memory. Returns the number of bytes written.
+    """
+    headers = {
+        'Content-Type': content_type,
+        'Accept': content_type,
+        'Authorization': 'Bearer ' + token
+    }
+
+    r = transport.request('GET', _api_url(uri, api_endpoint), headers=headers, stream=True)
+
+    if r.status_code != 200:
+        response = transport.read_body(r)
+        raise MxitAPIException("Unexpected HTTP Status: %s" % r.status_code,
+                               {'response': response, 'code': r.status_code})
+
+    if output_file_path:
+        with open(output_file_path, 'wb') as f:
+            return transport.write_body(r, f)
+
+    return transport.write_body(r, output_file)
+
+
+def _post(transport, token, uri, data={}, content_type='application/json', api_endpoint=None):
     headers = {
         'Content-Type': content_type,
         'Accept': content_type,
         'Authorization': 'Bearer ' + token
     }
 
-    if 'json' in content_type:
+    if 'json' in content_type and not _is_streamed(data):
         data = json.dumps(data)
 
-    r = post(api_endpoint + uri, data=data, headers=headers)
+    r = transport.request('POST', _api_url(uri, api_endpoint), data=data, headers=headers, stream=True)
 
-    response = ''
-    for chunk in r.iter_content():
-        response += chunk
+    response = transport.read_body(r)
 
     if r.status_code != 200:
         raise MxitAPIException("Unexpected HTTP Status: %s" % r.status_code,
@@ -555,21 +1321,19 @@ def _post(token, uri, data={}, content_type='application/json', api_endpoint=set
     return response
 
 
-def _put(token, uri, data={}, content_type='application/json', api_endpoint=settings.API_ENDPOINT):
+def _put(transport, token, uri, data={}, content_type='application/json', api_endpoint=None):
     headers = {
         'Content-Type': content_type,
         'Accept': content_type,
         'Authorization': 'Bearer ' + token
     }
 
-    if 'json' in content_type:
+    if 'json' in content_type and not _is_streamed(data):
         data = json.dumps(data)
 
-    r = put(api_endpoint + uri, data=data, headers=headers)
+    r = transport.request('PUT', _api_url(uri, api_endpoint), data=data, headers=headers, stream=True)
 
-    response = ''
-    for chunk in r.iter_content():
-        response += chunk
+    response = transport.read_body(r)
 
     if r.status_code != 200:
         raise MxitAPIException("Unexpected HTTP Status: %s" % r.status_code,
@@ -578,18 +1342,16 @@ def _put(token, uri, data={}, content_type='application/json', api_endpoint=sett
     return response
 
 
-def _delete(token, uri, content_type='application/json', api_endpoint=settings.API_ENDPOINT):
+def _delete(transport, token, uri, content_type='application/json', api_endpoint=None):
     headers = {
         'Content-Type': content_type,
         'Accept': content_type,
         'Authorization': 'Bearer ' + token
     }
 
-    r = delete(api_endpoint + uri, headers=headers)
+    r = transport.request('DELETE', _api_url(uri, api_endpoint), headers=headers, stream=True)
 
-    response = ''
-    for chunk in r.iter_content():
-        response += chunk
+    response = transport.read_body(r)
 
     if r.status_code != 200:
         raise MxitAPIException("Unexpected HTTP Status: %s" % r.status_code,
@@ -0,0 +1,377 @@
+"""
+Local stand-in for the Mxit auth and REST APIs, for benchmarking and testing without credentials or network
+access
+
+Implements /token and the endpoints used by MessagingService and UserService, with an in-memory gallery so that
+uploads, listings and downloads are consistent. Every request is delayed by latency seconds (plus up to jitter
+more) and binary content (avatars, cover images, seeded gallery files) is payload_size bytes.
+
+Usage: python -m mxit.stub_server [--port 8080] [--latency 0.05] [--payload-size 65536]
+"""
+import json
+import random
+import re
+import time
+import uuid
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from collections import OrderedDict, deque
+from threading import Lock, Thread
+from urllib import unquote
+from urlparse import urlparse, parse_qs
+
+DEFAULT_PAYLOAD_SIZE = 64 * 1024
+DEFAULT_CONTACTS = 500
+DEFAULT_GALLERY_ITEMS = 100
+TOKEN_EXPIRES_IN = 3600
+
+# Users whose IDs (or Mxit IDs) start with this don't exist: looking them up fails, and messages and file offers
+# to them are rejected
+UNKNOWN_USER_PREFIX = 'unknown'
+
+# Number of sent messages kept, so that long load tests don't fill memory
+MESSAGE_HISTORY = 10000
+
+
+class StubState(object):
+    """
+    The data served by the stub: a contact list and a gallery of folders of files, and the messages sent to it
+    """
+
+    def __init__(self, payload_size=DEFAULT_PAYLOAD_SIZE, contacts=DEFAULT_CONTACTS,
+                 gallery_items=DEFAULT_GALLERY_ITEMS):
+        self.payload = '\0' * payload_size
+        self.contacts = [{
+            'UserId': 'user%d' % i,
+            'DisplayName': 'User %d' % i,
+            'Type': 0,
+            'Group': 'Friends',
+        } for i in range(contacts)]
+
+        self.lock = Lock()
+        self.status = ''
+        self.profile = {'DisplayName': 'Stub', 'FirstName': 'Stub', 'LastName': 'User', 'UserId': 'stubuser'}
+        self.avatar = self.payload
+        self.cover = self.payload
+
+        # Bodies of the most recent messages sent
+        self.messages = deque(maxlen=MESSAGE_HISTORY)
+
+        # Files by id, and the ids of the files in each folder
+        self.files = {}
+        self.folders = OrderedDict()
+        self.folders['Default'] = []
+        for i in range(gallery_items):
+            self.add_file('Default', 'file%d.png' % i, 'image/png', self.payload)
+
+    def add_file(self, folder_name, file_name, content_type, data):
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = {'FileId': file_id, 'FileName': file_name, 'MimeType': content_type,
+                                   'Size': len(data), 'data': data}
+            self.folders.setdefault(folder_name, []).append(file_id)
+        return file_id
+
+    def items(self, folder_name):
+        with self.lock:
+            return [dict((k, v) for k, v in self.files[file_id].items() if k != 'data')
+                    for file_id in self.folders.get(folder_name, [])]
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer each response and send it in one go, so that small writes aren't held back by Nagle's algorithm
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    # (method, path pattern, handler method), tried in order
+    ROUTES = [
+        ('POST', r'/token', 'token'),
+        ('POST', r'/message/send', 'send_message'),
+        ('GET', r'/user/lookup/(.+)', 'user_id'),
+        ('GET', r'/user/public/statusmessage/(.+)', 'get_status'),
+        ('GET', r'/user/public/displayname/(.+)', 'display_name'),
+        ('GET', r'/user/public/avatar/(.+)', 'get_avatar'),
+        ('PUT', r'/user/statusmessage', 'set_status'),
+        ('GET', r'/user/avatar', 'get_avatar'),
+        ('POST', r'/user/avatar', 'set_avatar'),
+        ('DELETE', r'/user/avatar', 'empty'),
+        ('GET', r'/user/profile/(.+)', 'basic_profile'),
+        ('GET', r'/user/profile', 'full_profile'),
+        ('PUT', r'/user/profile', 'update_profile'),
+        ('PUT', r'/user/socialgraph/contact/(.+)', 'empty'),
+        ('GET', r'/user/socialgraph/contactlist', 'contact_list'),
+        ('GET', r'/user/socialgraph/suggestions', 'suggestions'),
+        ('GET', r'/user/media', 'folder_list'),
+        ('GET', r'/user/media/list/(.+)', 'item_list'),
+        ('GET', r'/user/media/content/(.+)', 'file_content'),
+        ('POST', r'/user/media/file/send', 'upload_and_offer'),
+        ('POST', r'/user/media/file/send/(.+)', 'offer_file'),
+        ('POST', r'/user/media/file/(.+)', 'upload_file'),
+        ('PUT', r'/user/media/file/(.+)', 'rename_file'),
+        ('DELETE', r'/user/media/file/(.+)', 'delete_file'),
+        ('POST', r'/user/media/([^/]+)', 'create_folder'),
+        ('PUT', r'/user/media/([^/]+)', 'rename_folder'),
+        ('DELETE', r'/user/media/([^/]+)', 'delete_folder'),
+        ('GET', r'/user/cover', 'get_cover'),
+        ('POST', r'/user/cover', 'set_cover'),
+    ]
+    ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in ROUTES]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def route(self, method):
+        url = urlparse(self.path)
+        self.query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        self.body = self.read_body()
+
+        delay = self.server.latency + random.uniform(0, self.server.jitter)
+        if delay:
+            time.sleep(delay)
+
+        for route_method, pattern, handler in self.ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                if handler != 'token' and not self.headers.get('Authorization', '').startswith('Bearer '):
+                    return self.respond(401, '')
+                return getattr(self, handler)(*[unquote(arg) for arg in match.groups()])
+
+        self.respond(404, '')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    return ''.join(chunks)
+
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def json_body(self, default=None):
+        return json.loads(self.body) if self.body else default
+
+    def respond(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond_json(self, data):
+        self.respond(200, json.dumps(data))
+
+    def empty(self, *args):
+        self.respond(200, '')
+
+    def send_message(self):
+        message = self.json_body()
+        if any(user_id.startswith(UNKNOWN_USER_PREFIX) for user_id in message['To'].split(',')):
+            return self.respond(400, '')
+        with self.state.lock:
+            self.state.messages.append(message)
+        self.empty()
+
+    def token(self):
+        form = dict((k, v[0]) for k, v in parse_qs(self.body).items())
+        self.respond_json({
+            'access_token': uuid.uuid4().hex,
+            'token_type': 'bearer',
+            'expires_in': TOKEN_EXPIRES_IN,
+            'scope': form.get('scope', ''),
+        })
+
+    def user_id(self, mxit_id):
+        if mxit_id.startswith(UNKNOWN_USER_PREFIX):
+            return self.respond(404, '')
+        self.respond_json('id_' + mxit_id)
+
+    def get_status(self, mxit_id):
+        self.respond_json(self.state.status)
+
+    def set_status(self):
+        self.state.status = self.json_body('')
+        self.empty()
+
+    def display_name(self, mxit_id):
+        self.respond_json('Name of ' + mxit_id)
+
+    def get_avatar(self, mxit_id=None):
+        self.respond(200, self.state.avatar, 'application/octet-stream')
+
+    def set_avatar(self):
+        self.state.avatar = self.body
+        self.empty()
+
+    def get_cover(self):
+        self.respond(200, self.state.cover, 'application/octet-stream')
+
+    def set_cover(self):
+        self.state.cover = self.body
+        self.empty()
+
+    def basic_profile(self, user_id):
+        self.respond_json(dict(self.state.profile, UserId=user_id))
+
+    def full_profile(self):
+        self.respond_json(self.state.profile)
+
+    def update_profile(self):
+        self.state.profile.update(self.json_body({}))
+        self.empty()
+
+    def contact_list(self):
+        skip = int(self.query.get('skip', 0))
+        count = int(self.query.get('count', len(self.state.contacts)))
+        self.respond_json({'Contacts': self.state.contacts[skip:skip + count]})
+
+    def suggestions(self):
+        self.respond_json({'Contacts': self.state.contacts[:10]})
+
+    def folder_list(self):
+        with self.state.lock:
+            self.respond_json({'Folders': list(self.state.folders)})
+
+    def item_list(self, folder_name):
+        items = self.state.items(folder_name)
+        skip = int(self.query.get('skip', 0))
+        count = int(self.query.get('count', len(items)))
+        self.respond_json(items[skip:skip + count])
+
+    def file_content(self, file_id):
+        item = self.state.files.get(file_id)
+        if item is None:
+            return self.respond(404, '')
+        self.respond(200, item['data'], item['MimeType'])
+
+    def upload_and_offer(self):
+        if self.query.get('userId', '').startswith(UNKNOWN_USER_PREFIX):
+            return self.respond(400, '')
+        file_id = self.state.add_file('Offers', self.query.get('fileName', ''), self.headers.get('Content-Type'),
+                                      self.body)
+        self.respond_json(file_id)
+
+    def offer_file(self, file_id):
+        if file_id not in self.state.files:
+            return self.respond(404, '')
+        self.respond(400 if self.query.get('UserId', '').startswith(UNKNOWN_USER_PREFIX) else 200, '')
+
+    def upload_file(self, folder_name):
+        file_id = self.state.add_file(folder_name, self.query.get('fileName', ''), self.headers.get('Content-Type'),
+                                      self.body)
+        self.respond_json(file_id)
+
+    def rename_file(self, file_id):
+        with self.state.lock:
+            if file_id in self.state.files:
+                self.state.files[file_id]['FileName'] = self.json_body()
+        self.empty()
+
+    def delete_file(self, file_id):
+        with self.state.lock:
+            self.state.files.pop(file_id, None)
+            for file_ids in self.state.folders.values():
+                if file_id in file_ids:
+                    file_ids.remove(file_id)
+        self.empty()
+
+    def create_folder(self, folder_name):
+        with self.state.lock:
+            self.state.folders.setdefault(folder_name, [])
+        self.empty()
+
+    def rename_folder(self, folder_name):
+        with self.state.lock:
+            if folder_name in self.state.folders:
+                self.state.folders[self.json_body()] = self.state.folders.pop(folder_name)
+        self.empty()
+
+    def delete_folder(self, folder_name):
+        with self.state.lock:
+            for file_id in self.state.folders.pop(folder_name, []):
+                self.state.files.pop(file_id, None)
+        self.empty()
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded stub Mxit API server; start() serves it in a background thread and url is its base URL, to be
+    used as both settings.AUTH_ENDPOINT and settings.API_ENDPOINT. Deleting or renaming missing items
+    succeeds, so that benchmarks can repeat those calls.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, payload_size=DEFAULT_PAYLOAD_SIZE,
+                 contacts=DEFAULT_CONTACTS, gallery_items=DEFAULT_GALLERY_ITEMS):
+        HTTPServer.__init__(self, (host, port), StubRequestHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.state = StubState(payload_size, contacts, gallery_items)
+        self.__thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        self.__thread = Thread(target=self.serve_forever, name='mxit-stub-server')
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = ArgumentParser(description='Serve a local stand-in for the Mxit APIs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many more seconds added at random')
+    parser.add_argument('--payload-size', type=int, default=DEFAULT_PAYLOAD_SIZE,
+                        help='bytes in avatars, cover images and seeded gallery files')
+    parser.add_argument('--contacts', type=int, default=DEFAULT_CONTACTS)
+    parser.add_argument('--gallery-items', type=int, default=DEFAULT_GALLERY_ITEMS)
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, args.latency, args.jitter, args.payload_size, args.contacts,
+                        args.gallery_items)
+    print "Serving the Mxit API stub on %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
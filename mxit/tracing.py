@@ -0,0 +1,210 @@
+import inspect
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import local
+from types import GeneratorType
+
+
+class Span(object):
+    """
+    One timed phase of an API call
+
+    Phases are 'call' (a service method), 'token' (an OAuth token lookup, with its source: 'memory', 'cache'
+    or 'fetched'), 'rate_limit' (waiting for the rate limiter), 'request' (one attempt, from sending the
+    request to receiving the response headers, so including any connection setup and the server's processing
+    time), 'backoff' (waiting before a retry) and 'body' (reading a streamed response body). Spans started while
+    another is in progress on the same thread are its children.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes or {}
+        self.error = None
+        self.start_time = time.time()
+        self.end_time = None
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time if self.end_time is not None else None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __repr__(self):
+        return '<Span %s %r>' % (self.name, self.attributes)
+
+
+class Tracer(object):
+    """
+    Receives the spans of the API calls made through a client
+
+    on_start and on_end are called with each span as it starts and ends; they can be given as callables or
+    overridden in a subclass (e.g. to forward spans to OpenTracing or Zipkin). They are called on the thread
+    making the call, so should be quick and must not raise.
+    """
+
+    def __init__(self, on_start=None, on_end=None):
+        if on_start is not None:
+            self.on_start = on_start
+        if on_end is not None:
+            self.on_end = on_end
+
+        self.__local = local()
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+    def current_span(self):
+        """
+        The innermost span in progress on this thread, if any
+        """
+        stack = getattr(self.__local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def start_span(self, name, **attributes):
+        """
+        Start a span as a child of the current span on this thread, without making it the current span
+        """
+        span = Span(name, self.current_span(), attributes)
+        self.on_start(span)
+        return span
+
+    @contextmanager
+    def activate(self, span):
+        """
+        Make span the current span on this thread for the block (without ending it), so that the spans started in
+        the block are its children
+        """
+        stack = getattr(self.__local, 'stack', None)
+        if stack is None:
+            stack = self.__local.stack = []
+
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+
+    def end_span(self, span, error=None):
+        if error is not None:
+            span.error = error
+        span.end_time = time.time()
+        self.on_end(span)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Time the block as a span, which can also be used to group the spans of several calls
+        """
+        span = self.start_span(name, **attributes)
+        try:
+            with self.activate(span):
+                yield span
+        except Exception as e:
+            span.error = e
+            raise
+        finally:
+            self.end_span(span)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(tracer, name, **attributes):
+    """
+    tracer.span(name, **attributes), or a span that does nothing if tracer is None
+    """
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, **attributes)
+
+
+def in_current_span(tracer, fn):
+    """
+    Wrap fn to run within the span that is current on this thread now, wherever it is called, so that the spans
+    of work handed to other threads are children of the call that handed it over
+    """
+    parent = tracer.current_span() if tracer is not None else None
+    if parent is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with tracer.activate(parent):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+def trace_calls(service_name):
+    """
+    Class decorator wrapping each public method of a service in a 'call' span, when its transport has a tracer
+    """
+    def decorate(cls):
+        for name, method in cls.__dict__.items():
+            if not name.startswith('_') and inspect.isfunction(method):
+                setattr(cls, name, _traced(service_name + '.' + name, method))
+        return cls
+
+    return decorate
+
+
+def _traced(call, method):
+    @wraps(method)
+    def traced(self, *args, **kwargs):
+        tracer = self.transport.tracer
+        if tracer is None:
+            return method(self, *args, **kwargs)
+
+        span = tracer.start_span('call', call=call)
+        try:
+            with tracer.activate(span):
+                result = method(self, *args, **kwargs)
+        except Exception as e:
+            tracer.end_span(span, e)
+            raise
+
+        if isinstance(result, GeneratorType):
+            # Generators make their requests as they are iterated, so the span lasts until they are exhausted
+            return _traced_iteration(tracer, span, result)
+
+        tracer.end_span(span)
+        return result
+
+    return traced
+
+
+def _traced_iteration(tracer, span, generator):
+    """
+    Iterate over generator with span current while it runs, ending the span once it is exhausted, fails or is
+    closed (or garbage collected)
+    """
+    error = None
+    try:
+        while True:
+            with tracer.activate(span):
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+            yield item
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        tracer.end_span(span, error)
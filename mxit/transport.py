@@ -0,0 +1,163 @@
+import time
+from urlparse import urlparse
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from mxit.metrics import endpoint_name
+from mxit.retry import RetryPolicy
+from mxit.tracing import span
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class Transport(object):
+    """
+    Pooled, keep-alive HTTP transport shared by the OAuth provider and the services
+
+    pool_connections is the number of hosts to keep connection pools for,
+    pool_maxsize is the number of connections kept alive per host and
+    chunk_size is the number of bytes read from the socket at a time.
+    Failed requests are retried according to retry_policy (see mxit.retry.RetryPolicy) and, if a
+    rate_limiter is given (see mxit.ratelimit.RateLimiter), every attempt waits for its turn. If metrics is
+    given (see mxit.metrics.Metrics), every request is recorded in it once its response body has been read, and
+    if tracer is given (see mxit.tracing.Tracer), the phases of every request are reported to it as spans.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE, retry_policy=None, rate_limiter=None, metrics=None,
+                 tracer=None):
+        self.session = Session()
+        self.chunk_size = chunk_size
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.tracer = tracer
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Make a request, retrying it as allowed by the retry policy. idempotent overrides whether the policy
+        treats the request as safe to repeat, which otherwise depends on the method.
+        Returns the last response, whatever its status; connection errors are raised once retries run out.
+        Streamed response bodies should be read with read_body or write_body, so that they are recorded in metrics
+        """
+        policy = self.retry_policy
+        if idempotent is None:
+            idempotent = policy.is_idempotent(method)
+
+        rewind = _rewinder(kwargs.get('data'))
+        policy.budget.deposit()
+
+        path = urlparse(url).path
+        endpoint = endpoint_name(path)
+        started_at = time.time()
+
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                with span(self.tracer, 'rate_limit', endpoint=endpoint):
+                    self.rate_limiter.acquire(path)
+
+            try:
+                with span(self.tracer, 'request', method=method, endpoint=endpoint, attempt=attempt) as s:
+                    r = self.session.request(method, url, **kwargs)
+                    s.set_attribute('status_code', r.status_code)
+            except ConnectionError:
+                if not (idempotent and self.__may_retry(attempt, rewind)):
+                    if self.metrics is not None:
+                        self.metrics.record_error(endpoint)
+                    raise
+                delay = policy.backoff(attempt)
+            else:
+                if not (policy.should_retry_status(r.status_code, idempotent) and self.__may_retry(attempt, rewind)):
+                    r.endpoint = endpoint
+                    r.started_at = started_at
+                    if not kwargs.get('stream'):
+                        self.__observe(r, len(r.content))
+                    return r
+                delay = policy.backoff(attempt, r.headers.get('retry-after'))
+
+                # Read the error body so the connection goes back to the pool
+                r.content
+
+            if self.metrics is not None:
+                self.metrics.record_retry(endpoint)
+
+            with span(self.tracer, 'backoff', endpoint=endpoint, delay=delay):
+                time.sleep(delay)
+            rewind()
+            attempt += 1
+
+    def __may_retry(self, attempt, rewind):
+        return attempt < self.retry_policy.max_retries and rewind is not None and self.retry_policy.budget.withdraw()
+
+    def read_body(self, r):
+        """
+        Read the full body of a streamed response in chunk_size reads, joining the chunks once at the end
+        """
+        with span(self.tracer, 'body', endpoint=_endpoint(r)) as s:
+            body = ''.join(r.iter_content(self.chunk_size))
+            s.set_attribute('bytes', len(body))
+        self.__observe(r, len(body))
+        return body
+
+    def write_body(self, r, output_file):
+        """
+        Write the body of a streamed response to output_file in chunk_size reads, returning the number of bytes
+        written
+        """
+        size = 0
+        with span(self.tracer, 'body', endpoint=_endpoint(r)) as s:
+            for chunk in r.iter_content(self.chunk_size):
+                output_file.write(chunk)
+                size += len(chunk)
+            s.set_attribute('bytes', size)
+        self.__observe(r, size)
+        return size
+
+    def __observe(self, r, response_bytes):
+        # Only responses made through request() know when they were started
+        if self.metrics is not None and hasattr(r, 'started_at'):
+            self.metrics.observe_request(r.endpoint, r.request.method, r.status_code, time.time() - r.started_at,
+                                         _request_bytes(r.request), response_bytes)
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        self.session.close()
+
+
+def _endpoint(r):
+    """
+    The endpoint a response is recorded under, worked out from its URL if it wasn't made through request()
+    """
+    return getattr(r, 'endpoint', None) or endpoint_name(urlparse(r.url or '').path)
+
+
+def _request_bytes(request):
+    length = request.headers.get('Content-Length')
+    if length is not None:
+        return int(length)
+    # Chunked bodies have no length, so only what is known up front is counted
+    return len(request.body) if isinstance(request.body, basestring) else 0
+
+
+def _rewinder(data):
+    """
+    Return a function that resets the request body so it can be sent again, or None if it can't be
+    """
+    if data is None or isinstance(data, (basestring, dict, list, tuple)):
+        return lambda: None
+
+    if hasattr(data, 'seek') and hasattr(data, 'tell'):
+        position = data.tell()
+        return lambda: data.seek(position)
+
+    # Iterators can only be consumed once
+    return None
@@ -19,6 +19,7 @@ setup(
     long_description=LONG_DESCRIPTION,
     install_requires=[
         "requests == 2.0.1",
+        "futures == 3.3.0",
     ],
 )
 
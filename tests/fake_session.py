@@ -0,0 +1,49 @@
+import json
+from io import BytesIO
+from requests.models import Request, Response
+from mxit.retry import RetryPolicy
+from mxit.transport import Transport
+
+
+class FakeSession(object):
+    """
+    Stands in for the requests session, answering requests with the given outcomes in turn and then with 200s
+
+    An outcome is a status code, a (status code, headers) pair or an exception to raise. /token requests are
+    answered with an access token and anything else with body. The body of each request is kept in bodies
+    """
+
+    def __init__(self, outcomes=(), body='x' * 100):
+        self.outcomes = list(outcomes)
+        self.body = body
+        self.bodies = []
+
+    def request(self, method, url, **kwargs):
+        data = kwargs.get('data')
+        if hasattr(data, 'read'):
+            data = data.read()
+        self.bodies.append(data)
+
+        outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        status_code, headers = outcome if isinstance(outcome, tuple) else (outcome, {})
+
+        r = Response()
+        r.status_code = status_code
+        r.headers.update(headers)
+        if url.endswith('/token'):
+            r.raw = BytesIO(json.dumps({'access_token': 'token', 'expires_in': 3600}))
+        else:
+            r.raw = BytesIO(self.body)
+        r.request = Request(method, url, data=data).prepare()
+        return r
+
+
+def fake_transport(outcomes=(), body='x' * 100, retry_policy=None, **kwargs):
+    """
+    A Transport (taking the same keyword arguments) on a FakeSession, retrying without backoff by default
+    """
+    transport = Transport(retry_policy=retry_policy or RetryPolicy(backoff_factor=0), **kwargs)
+    transport.session = FakeSession(outcomes, body)
+    return transport
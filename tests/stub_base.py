@@ -0,0 +1,24 @@
+import unittest
+from mxit import Mxit, settings
+from mxit.stub_server import StubServer
+
+
+class TestAgainstStubServer(unittest.TestCase):
+    """
+    Starts a local stub server for each test, with the client's endpoints pointed at it
+
+    Subclasses can pass arguments to the StubServer in stub_options.
+    """
+    stub_options = {}
+
+    def setUp(self):
+        self.server = StubServer(**self.stub_options).start()
+        self.endpoints = settings.AUTH_ENDPOINT, settings.API_ENDPOINT
+        settings.AUTH_ENDPOINT = settings.API_ENDPOINT = self.server.url
+
+        self.client = Mxit('client_id', 'client_secret', redirect_uri='http://localhost/')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        settings.AUTH_ENDPOINT, settings.API_ENDPOINT = self.endpoints
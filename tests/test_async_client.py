@@ -0,0 +1,54 @@
+import threading
+import time
+from concurrent.futures import Future
+from mxit import AsyncMxit
+from mxit.exceptions import MxitAPIException
+from tests.stub_base import TestAgainstStubServer
+
+
+class TestAsyncMxit(TestAgainstStubServer):
+    def setUp(self):
+        super(TestAsyncMxit, self).setUp()
+        self.async_client = AsyncMxit('client_id', 'client_secret', max_workers=5, redirect_uri='http://localhost/')
+
+    def tearDown(self):
+        self.async_client.shutdown()
+        super(TestAsyncMxit, self).tearDown()
+
+    def test_calls_return_futures(self):
+        futures = [self.async_client.users.get_user_id('mxit%d' % i) for i in range(10)]
+        self.assertTrue(all(isinstance(f, Future) for f in futures))
+        self.assertEqual(['id_mxit%d' % i for i in range(10)], [f.result() for f in futures])
+        self.assertEqual('', self.async_client.messaging.send_message('app', ['user1'], 'Hello').result())
+
+    def test_exceptions_propagate(self):
+        self.async_client.oauth.get_user_token('content/read', code='code').result()
+        future = self.async_client.users.get_gallery_file('unknown')
+        self.assertIsInstance(future.exception(), MxitAPIException)
+
+    def test_generators_are_run_on_the_executor(self):
+        future = self.async_client.users.resolve_mxit_ids(['mxit1', 'mxit2'], fields=('user_id',))
+        self.assertIsInstance(future.result(), list)
+        self.assertEqual(['id_mxit1', 'id_mxit2'], sorted(result.values['user_id'] for result in future.result()))
+
+        self.async_client.oauth.get_user_token('graph/read', code='code').result()
+        contacts = self.async_client.users.iter_contact_list('@All', page_size=100).result()
+        self.assertEqual(500, len(contacts))
+
+    def test_local_methods_are_not_wrapped(self):
+        auth_url = self.async_client.oauth.auth_url('profile/public')
+        self.assertIsInstance(auth_url, basestring)
+        self.assertEqual(self.client.oauth.auth_url('profile/public'), auth_url)
+        self.assertIsInstance(self.async_client.oauth.cache_stats(), dict)
+
+    def test_shutdown_stops_background_refresh(self):
+        client = AsyncMxit('client_id', 'client_secret', background_token_refresh=True)
+        client.oauth.get_app_token('profile/public').result()
+        self.assertTrue(self.refreshers())
+
+        client.shutdown()
+        time.sleep(0.1)
+        self.assertFalse(self.refreshers())
+
+    def refreshers(self):
+        return [thread for thread in threading.enumerate() if thread.name == 'mxit-token-refresher']
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+from time import sleep
+from mxit.cache import LRUCache, FileCache
+from mxit.services import UserService
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get('missing'))
+        cache.set('key', 'value')
+        self.assertEqual('value', cache.get('key'))
+        self.assertEqual({'size': 1, 'max_size': cache.max_size, 'hits': 1, 'misses': 1, 'evictions': 0},
+                         cache.stats())
+
+    def test_expiry(self):
+        cache = LRUCache()
+        cache.set('key', 'value', 0.05)
+        self.assertEqual('value', cache.get('key'))
+        sleep(0.1)
+        self.assertIsNone(cache.get('key'))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(1, cache.evictions)
+
+    def test_clear_matching(self):
+        cache = LRUCache()
+        cache.set(('status', 'a'), 'x')
+        cache.set(('user_id', 'a'), 'y')
+        cache.clear(lambda key: key[0] == 'status')
+        self.assertIsNone(cache.get(('status', 'a')))
+        self.assertEqual('y', cache.get(('user_id', 'a')))
+
+
+class TestUserServiceCache(unittest.TestCase):
+    def setUp(self):
+        self.users = UserService(oauth=None, cache=LRUCache())
+
+    def test_cached_lookup_skips_request(self):
+        self.users.cache.set(('user_id', 'example_mxit_id'), 'example_user_id')
+        self.assertEqual('example_user_id', self.users.get_user_id('example_mxit_id'))
+
+    def test_invalidate_cache(self):
+        self.users.cache.set(('status', 'a'), 'x')
+        self.users.cache.set(('status', 'b'), 'y')
+        self.users.cache.set(('display_name', 'a'), 'z')
+        self.users.invalidate_cache('status', 'a')
+        self.assertIsNone(self.users.cache.get(('status', 'a')))
+        self.assertEqual('y', self.users.cache.get(('status', 'b')))
+        self.users.invalidate_cache()
+        self.assertEqual(0, len(self.users.cache))
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp()
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_values_persist_with_their_ttl(self):
+        FileCache(self.path).set('key', 'value', 60)
+        value, ttl = FileCache(self.path).get_with_ttl('key')
+        self.assertEqual('value', value)
+        self.assertTrue(0 < ttl <= 60)
+
+    def test_expiry_and_delete(self):
+        cache = FileCache(self.path)
+        cache.set('expired', 'value', -1)
+        cache.set('key', 'value')
+        self.assertIsNone(cache.get('expired'))
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
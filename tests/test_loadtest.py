@@ -0,0 +1,32 @@
+import unittest
+from argparse import ArgumentTypeError, Namespace
+from mxit.loadtest import LoadGenerator, parse_mix
+from tests.stub_base import TestAgainstStubServer
+
+
+class TestParseMix(unittest.TestCase):
+    def test_weights(self):
+        self.assertEqual([('send_message', 3.0), ('get_user_id', 1.0)], parse_mix('send_message=3,get_user_id'))
+
+    def test_unknown_operation(self):
+        self.assertRaises(ArgumentTypeError, parse_mix, 'send_message=3,delete_everything=1')
+
+
+class TestLoadGenerator(TestAgainstStubServer):
+    def setUp(self):
+        super(TestLoadGenerator, self).setUp()
+        self.options = Namespace(app_id='app', user_id='user', mxit_id='someone', message='Hello', payload='data')
+
+    def test_concurrency(self):
+        generator = LoadGenerator(self.client, self.options, parse_mix('send_message,get_user_id'), requests=40)
+        generator.run_concurrency(4)
+
+        latencies = generator.stats.latencies
+        self.assertEqual(40, sum(len(l) for l in latencies.values()))
+        self.assertEqual({'send_message', 'get_user_id'}, set(latencies))
+        self.assertEqual({}, dict(generator.stats.errors))
+
+    def test_rate(self):
+        generator = LoadGenerator(self.client, self.options, parse_mix('get_status'), duration=0.5)
+        generator.run_rate(20, 5)
+        self.assertEqual(10, len(generator.stats.latencies['get_status']))
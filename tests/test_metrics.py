@@ -0,0 +1,61 @@
+import unittest
+from io import BytesIO
+from requests.models import Response
+from requests.exceptions import ConnectionError
+from mxit.metrics import Metrics, endpoint_name
+from tests.fake_session import fake_transport
+
+
+def _transport(outcomes):
+    return fake_transport(outcomes, metrics=Metrics())
+
+
+class TestEndpointName(unittest.TestCase):
+    def test_ids_are_grouped(self):
+        self.assertEqual('/user/lookup/*', endpoint_name('/user/lookup/someone'))
+        self.assertEqual('/user/media/file/send/*', endpoint_name('/user/media/file/send/1234'))
+        self.assertEqual('/user/media/file/*', endpoint_name('/user/media/file/1234'))
+        self.assertEqual('/user/profile', endpoint_name('/user/profile'))
+        self.assertEqual('other', endpoint_name('/unknown'))
+
+
+class TestMetrics(unittest.TestCase):
+    def test_streamed_request(self):
+        transport = _transport([503, 200])
+        r = transport.request('POST', 'http://api/user/media/file/folder', idempotent=True, data='abcd', stream=True)
+        transport.read_body(r)
+
+        snapshot = transport.metrics.snapshot()
+        self.assertEqual({('/user/media/file/*', 'POST', 200): 1}, snapshot['responses'])
+        self.assertEqual({'/user/media/file/*': 1}, snapshot['retries'])
+        self.assertEqual({'/user/media/file/*': 4}, snapshot['request_bytes'])
+        self.assertEqual({'/user/media/file/*': 100}, snapshot['response_bytes'])
+        self.assertEqual(1, snapshot['latency'][('/user/media/file/*', 'POST')]['count'])
+
+    def test_response_not_made_by_transport(self):
+        r = Response()
+        r.status_code = 200
+        r.raw = BytesIO('abc')
+
+        transport = _transport([])
+        self.assertEqual('abc', transport.read_body(r))
+        self.assertEqual({}, transport.metrics.snapshot()['responses'])
+
+    def test_connection_errors(self):
+        transport = _transport([ConnectionError()] * 4)
+        self.assertRaises(ConnectionError, transport.request, 'GET', 'http://api/user/lookup/someone')
+        self.assertEqual({'/user/lookup/*': 1}, transport.metrics.snapshot()['errors'])
+
+    def test_prometheus(self):
+        metrics = Metrics(latency_buckets=(0.1, 1))
+        metrics.observe_request('/message/send', 'POST', 200, 0.5, 10, 2)
+        metrics.record_token_fetch('client_credentials')
+
+        text = metrics.to_prometheus()
+        self.assertIn('mxit_request_duration_seconds_bucket{endpoint="/message/send",le="0.1",method="POST"} 0', text)
+        self.assertIn('mxit_request_duration_seconds_bucket{endpoint="/message/send",le="1",method="POST"} 1', text)
+        self.assertIn('mxit_request_duration_seconds_bucket{endpoint="/message/send",le="+Inf",method="POST"} 1',
+                      text)
+        self.assertIn('mxit_responses_total{code="200",endpoint="/message/send",method="POST"} 1', text)
+        self.assertIn('mxit_request_bytes_total{endpoint="/message/send"} 10', text)
+        self.assertIn('mxit_token_fetches_total{grant_type="client_credentials"} 1', text)
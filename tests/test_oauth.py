@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from time import sleep
+from mxit.cache import FileCache
+from mxit import oauth
+from mxit.oauth import OAuth
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.__data = data
+
+    def json(self):
+        return json.loads(json.dumps(self.__data))
+
+
+class FakeTokenTransport(object):
+    """
+    Stands in for the HTTP transport, answering every /token request with a new token after a delay
+    """
+
+    def __init__(self, delay=0.1, expires_in=3600):
+        self.delay = delay
+        self.expires_in = expires_in
+        self.requests = []
+        self.metrics = None
+        self.tracer = None
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(kwargs['data'])
+        sleep(self.delay)
+        return FakeResponse(200, {
+            'access_token': 'token_%d' % len(self.requests),
+            'expires_in': self.expires_in,
+        })
+
+
+class TestAppTokenConcurrency(unittest.TestCase):
+    def setUp(self):
+        self.transport = FakeTokenTransport()
+        self.oauth = OAuth('client_id', 'client_secret', transport=self.transport)
+
+    def test_concurrent_requests_share_one_token_request(self):
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(self.oauth.get_app_token('profile/public')))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(self.transport.requests))
+        self.assertEqual(['token_1'] * 20, tokens)
+
+    def test_tokens_for_other_scopes_are_kept(self):
+        self.oauth.get_app_token('profile/public')
+        self.oauth.get_app_token('message/send')
+        self.assertEqual('token_1', self.oauth.get_app_token('profile/public'))
+        self.assertEqual(2, len(self.transport.requests))
+
+
+class TestTokenExpiry(unittest.TestCase):
+    def test_expired_token_is_requested_again(self):
+        transport = FakeTokenTransport(delay=0, expires_in=0)
+        oauth = OAuth('client_id', 'client_secret', transport=transport)
+        self.assertEqual('token_1', oauth.get_app_token('profile/public'))
+        self.assertEqual('token_2', oauth.get_app_token('profile/public'))
+
+    def setUp(self):
+        self.min_refresh_interval = oauth.MIN_REFRESH_INTERVAL
+        oauth.MIN_REFRESH_INTERVAL = 0.01
+
+    def tearDown(self):
+        oauth.MIN_REFRESH_INTERVAL = self.min_refresh_interval
+
+    def test_background_refresh(self):
+        transport = FakeTokenTransport(delay=0, expires_in=0.3)
+        provider = OAuth('client_id', 'client_secret', transport=transport, background_refresh=True,
+                         refresh_ahead=0.2)
+        self.assertEqual('token_1', provider.get_app_token('profile/public'))
+        transport.expires_in = 3600
+        sleep(0.5)
+        provider.stop_background_refresh()
+        self.assertEqual(2, len(transport.requests))
+        self.assertEqual('token_2', provider.get_app_token('profile/public'))
+
+    def test_background_refresh_of_short_lived_tokens(self):
+        # Tokens that don't outlive refresh_ahead are refreshed halfway through their lifetime, not continuously
+        transport = FakeTokenTransport(delay=0, expires_in=3600)
+        provider = OAuth('client_id', 'client_secret', transport=transport, background_refresh=True,
+                         refresh_ahead=3600)
+        provider.get_app_token('profile/public')
+        sleep(0.2)
+        provider.stop_background_refresh()
+        self.assertEqual(1, len(transport.requests))
+
+
+class TestScopeMatching(unittest.TestCase):
+    def setUp(self):
+        self.transport = FakeTokenTransport(delay=0)
+        self.oauth = OAuth('client_id', 'client_secret', transport=self.transport)
+
+    def test_combined_token_is_reused_for_each_scope_and_any_order(self):
+        self.oauth.get_app_token('profile/public message/send content/send')
+        self.assertEqual('token_1', self.oauth.get_app_token('message/send'))
+        self.assertEqual('token_1', self.oauth.get_app_token('content/send profile/public'))
+        self.assertEqual(1, len(self.transport.requests))
+
+    def test_token_for_fewer_scopes_is_not_reused(self):
+        self.oauth.get_app_token('profile/public')
+        self.assertEqual('token_2', self.oauth.get_app_token('profile/public message/send'))
+
+
+class TestSharedTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        self.transport = FakeTokenTransport(delay=0)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_token_is_shared_and_promoted(self):
+        first = OAuth('client_id', 'client_secret', cache=FileCache(self.path), transport=self.transport)
+        second = OAuth('client_id', 'client_secret', cache=FileCache(self.path), transport=self.transport)
+
+        self.assertEqual('token_1', first.get_app_token('profile/public'))
+        self.assertEqual('token_1', second.get_app_token('profile/public'))
+        self.assertEqual('token_1', second.get_app_token('profile/public'))
+
+        self.assertEqual(1, len(self.transport.requests))
+        self.assertEqual({'l1_hits': 1, 'l2_hits': 1, 'misses': 0}, second.cache_stats())
+
+    def test_short_lived_token_is_shared(self):
+        transport = FakeTokenTransport(delay=0, expires_in=240)
+        first = OAuth('client_id', 'client_secret', cache=FileCache(self.path), transport=transport)
+        second = OAuth('client_id', 'client_secret', cache=FileCache(self.path), transport=transport)
+
+        self.assertEqual('token_1', first.get_app_token('profile/public'))
+        self.assertEqual('token_1', second.get_app_token('profile/public'))
+        self.assertEqual(1, len(transport.requests))
+
+    def test_token_without_expiry_is_not_shared(self):
+        transport = FakeTokenTransport(delay=0, expires_in=None)
+        first = OAuth('client_id', 'client_secret', cache=FileCache(self.path), transport=transport)
+        second = OAuth('client_id', 'client_secret', cache=FileCache(self.path), transport=transport)
+
+        self.assertEqual('token_1', first.get_app_token('profile/public'))
+        self.assertEqual('token_1', first.get_app_token('profile/public'))
+        self.assertEqual('token_2', second.get_app_token('profile/public'))
+
+    def test_user_token_is_read_from_shared_cache(self):
+        cache = FileCache(self.path)
+        first = OAuth('client_id', 'client_secret', 'http://example.org/', cache=cache, transport=self.transport)
+        second = OAuth('client_id', 'client_secret', 'http://example.org/', cache=cache, transport=self.transport)
+
+        self.assertEqual('token_1', first.get_user_token('profile/private', 'auth_code'))
+        self.assertEqual('token_1', second.get_user_token('profile/private'))
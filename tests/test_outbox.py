@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from mxit.exceptions import MxitAPIException
+from mxit.outbox import Outbox
+from tests.stub_base import TestAgainstStubServer
+
+
+class FailingMessaging(object):
+    """
+    Fails each send with the given errors, in turn, before succeeding
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    def send_message(self, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(kwargs)
+
+
+class TestOutbox(TestAgainstStubServer):
+    def setUp(self):
+        super(TestOutbox, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'outbox.db')
+
+    def tearDown(self):
+        super(TestOutbox, self).tearDown()
+        shutil.rmtree(self.dir)
+
+    def test_send(self):
+        with Outbox(self.client.messaging, self.path, workers=3) as outbox:
+            for i in range(20):
+                outbox.put('app', ['user%d' % i], 'Hello')
+            self.assertTrue(outbox.drain(timeout=10))
+
+            stats = outbox.stats()
+            self.assertEqual((0, 0, 0, 20), (stats['pending'], stats['sending'], stats['failed'], stats['sent']))
+            self.assertTrue(stats['drain_rate'] > 0)
+
+        self.assertEqual(['user%d' % i for i in range(20)], sorted((m['To'] for m in self.server.state.messages),
+                                                                   key=lambda to: int(to[4:])))
+
+    def test_messages_survive_restart(self):
+        outbox = Outbox(self.client.messaging, self.path)
+        outbox.put_many([{'app_mxit_id': 'app', 'target_user_ids': ['user%d' % i]} for i in range(5)])
+        self.assertEqual(5, outbox.stats()['pending'])
+        outbox.close()
+
+        with Outbox(self.client.messaging, self.path) as outbox:
+            self.assertTrue(outbox.drain(timeout=10))
+        self.assertEqual(5, len(self.server.state.messages))
+
+    def test_retries_and_failures(self):
+        messaging = FailingMessaging(MxitAPIException('Unexpected HTTP Status: 503', {'code': 503}),
+                                     MxitAPIException('Unexpected HTTP Status: 400', {'code': 400}))
+        with Outbox(messaging, self.path, workers=1, retry_delay=0.01) as outbox:
+            outbox.put('app', ['user1'], 'Hello')
+            self.assertTrue(outbox.drain(timeout=10))
+
+            failed = outbox.failed_messages()
+            self.assertEqual(1, len(failed))
+            self.assertEqual((2, 'MxitAPIException'), (failed[0][2], failed[0][3].split(':')[0]))
+            self.assertEqual(1, outbox.stats()['retried'])
+
+            self.assertEqual(1, outbox.retry_failed())
+            self.assertTrue(outbox.drain(timeout=10))
+        self.assertEqual([['user1']], [m['target_user_ids'] for m in messaging.sent])
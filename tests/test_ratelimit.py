@@ -0,0 +1,38 @@
+import unittest
+from time import time
+from mxit.exceptions import MxitAPIRateLimitException
+from mxit.ratelimit import RateLimiter, TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10, burst=3)
+        self.assertEqual([0, 0, 0], [bucket.reserve() for _ in range(3)])
+        self.assertTrue(0 < bucket.reserve() <= 0.1)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_most_specific_family(self):
+        limiter = RateLimiter({'/user/*': (1, 1), '/user/media/*': (1, 1)})
+        self.assertEqual('/user/media/*', limiter.family('/user/media/file/abc'))
+        self.assertEqual('/user/*', limiter.family('/user/profile'))
+        self.assertIsNone(limiter.family('/message/send'))
+
+    def test_fail_fast(self):
+        limiter = RateLimiter({'/message/send': (1, 2)}, block=False)
+        limiter.acquire('/message/send')
+        limiter.acquire('/message/send')
+        self.assertRaises(MxitAPIRateLimitException, limiter.acquire, '/message/send')
+        limiter.acquire('/user/profile')
+
+    def test_blocking(self):
+        limiter = RateLimiter({'/message/send': (20, 1)})
+        start = time()
+        for _ in range(5):
+            limiter.acquire('/message/send')
+        self.assertTrue(time() - start >= 0.15)
+
+    def test_max_wait(self):
+        limiter = RateLimiter({'/message/send': (1, 1)}, max_wait=0.1)
+        limiter.acquire('/message/send')
+        self.assertRaises(MxitAPIRateLimitException, limiter.acquire, '/message/send')
@@ -0,0 +1,63 @@
+import unittest
+from io import BytesIO
+from email.utils import formatdate
+from time import time
+from requests.exceptions import ConnectionError
+from mxit.retry import RetryPolicy, RetryBudget
+from tests.fake_session import fake_transport
+
+
+def _transport(outcomes, **policy_args):
+    policy_args.setdefault('backoff_factor', 0)
+    return fake_transport(outcomes, retry_policy=RetryPolicy(**policy_args))
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_backoff_is_capped(self):
+        policy = RetryPolicy(backoff_factor=1, max_backoff=5)
+        for attempt in range(10):
+            self.assertTrue(0 <= policy.backoff(attempt) <= 5)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(max_backoff=30)
+        self.assertEqual(2, policy.backoff(0, '2'))
+        self.assertEqual(30, policy.backoff(0, '120'))
+        self.assertTrue(5 <= policy.backoff(0, formatdate(time() + 10, usegmt=True)) <= 10)
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, initial=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+
+class TestTransportRetries(unittest.TestCase):
+    def test_idempotent_request_is_retried(self):
+        transport = _transport([503, ConnectionError(), 200])
+        self.assertEqual(200, transport.request('GET', 'http://example.org/').status_code)
+
+    def test_retries_run_out(self):
+        transport = _transport([503] * 3, max_retries=2)
+        self.assertEqual(503, transport.request('GET', 'http://example.org/').status_code)
+        self.assertEqual(3, len(transport.session.bodies))
+
+    def test_post_is_only_retried_when_not_processed(self):
+        transport = _transport([503])
+        self.assertEqual(503, transport.request('POST', 'http://example.org/').status_code)
+
+        transport = _transport([(429, {'retry-after': '0'}), 200])
+        self.assertEqual(200, transport.request('POST', 'http://example.org/').status_code)
+
+        transport = _transport([ConnectionError()])
+        self.assertRaises(ConnectionError, transport.request, 'POST', 'http://example.org/')
+
+    def test_file_body_is_rewound(self):
+        transport = _transport([429, 200])
+        transport.request('POST', 'http://example.org/', data=BytesIO(b'body'))
+        self.assertEqual([b'body', b'body'], transport.session.bodies)
+
+    def test_iterator_body_is_not_retried(self):
+        transport = _transport([429, 200])
+        self.assertEqual(429, transport.request('POST', 'http://example.org/', data=iter([b'body'])).status_code)
@@ -0,0 +1,298 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from mxit.cache import LRUCache
+from mxit.exceptions import MxitAPIException
+from mxit.services import UserService
+from tests.stub_base import TestAgainstStubServer
+
+
+class SlowLRUCache(LRUCache):
+    """
+    Answers lookups late, as a remote cache would
+    """
+
+    def get(self, key, default=None):
+        value = LRUCache.get(self, key, default)
+        time.sleep(0.1)
+        return value
+
+
+class TestServices(TestAgainstStubServer):
+    stub_options = {'payload_size': 1024, 'contacts': 30, 'gallery_items': 5}
+
+    def setUp(self):
+        super(TestServices, self).setUp()
+        self.client.oauth.get_user_token('content/read content/write graph/read', code='code')
+
+    def test_public_calls(self):
+        self.assertEqual('id_someone', self.client.users.get_user_id('someone'))
+        self.assertEqual(1024, len(self.client.users.get_avatar('someone')))
+        self.assertEqual('', self.client.messaging.send_message('app', ['user1'], 'Hello'))
+
+    def test_broadcast_message(self):
+        user_ids = ['user%d' % i for i in range(25)]
+        user_ids[12] = 'unknown'
+
+        results = self.client.messaging.broadcast_message('app', user_ids, 'Hello', batch_size=10, max_workers=3)
+        self.assertEqual([user_ids[:10], user_ids[10:20], user_ids[20:]], [result.user_ids for result in results])
+        self.assertEqual([True, False, True], [result.ok for result in results])
+        self.assertEqual(400, results[1].error.args[1]['code'])
+        self.assertEqual(sorted([','.join(user_ids[:10]), ','.join(user_ids[20:])]),
+                         sorted(message['To'] for message in self.server.state.messages))
+
+    def test_resolve_mxit_ids(self):
+        users = self.client.users
+        results = list(users.resolve_mxit_ids(['mxit1', 'unknown', 'mxit2', 'mxit1'],
+                                              fields=('user_id', 'display_name'), max_workers=2))
+        self.assertEqual(['mxit1', 'mxit2', 'unknown'], sorted(result.mxit_id for result in results))
+
+        results = dict((result.mxit_id, result) for result in results)
+        self.assertEqual({'user_id': 'id_mxit1', 'display_name': 'Name of mxit1'}, results['mxit1'].values)
+        self.assertTrue(results['mxit2'].ok)
+        self.assertEqual(404, results['unknown'].error.args[1]['code'])
+
+        self.assertRaises(ValueError, users.resolve_mxit_ids, ['mxit1'], fields=('user_id', 'email'))
+
+    def test_gallery(self):
+        users = self.client.users
+        users.create_gallery_folder('Photos')
+        file_id = users.upload_gallery_file('Photos', 'photo.png', 'data')
+
+        self.assertEqual(['Default', 'Photos'], users.get_gallery_folder_list()['Folders'])
+        self.assertEqual(['photo.png'], [item['FileName'] for item in users.get_gallery_item_list('Photos')])
+        self.assertEqual('data', users.get_gallery_file(json.loads(file_id)))
+
+    def test_upload_bodies(self):
+        users = self.client.users
+        local_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(local_dir, 'photo.png')
+            with open(path, 'wb') as f:
+                f.write('x' * 100)
+
+            def chunks():
+                yield 'x' * 60
+                yield 'x' * 40
+
+            for kwargs in ({'input_file_path': path}, {'input_file_path': path, 'use_mmap': True},
+                           {'data': BytesIO('x' * 100)}, {'data': chunks()}):
+                file_id = json.loads(users.upload_gallery_file('Photos', 'photo.png', **kwargs))
+                self.assertEqual('x' * 100, self.server.state.files[file_id]['data'])
+
+            open(path, 'wb').close()
+            self.assertRaises(ValueError, users.upload_gallery_file, 'Photos', 'photo.png', input_file_path=path)
+            self.assertRaises(ValueError, users.upload_gallery_file, 'Photos', 'photo.png', input_file_path=path,
+                              use_mmap=True)
+            self.assertEqual(4, len(self.server.state.folders['Photos']))
+        finally:
+            shutil.rmtree(local_dir)
+
+    def test_downloads_to_file(self):
+        users = self.client.users
+        file_id = self.server.state.folders['Default'][0]
+        local_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(local_dir, 'file0.png')
+            self.assertEqual(1024, users.get_gallery_file(file_id, output_file_path=path))
+            self.assertEqual(1024, os.path.getsize(path))
+
+            output_file = BytesIO()
+            self.assertEqual(1024, users.get_avatar('someone', output_file=output_file))
+            self.assertEqual(1024, len(output_file.getvalue()))
+
+            # A failed download neither creates nor truncates the target
+            missing = os.path.join(local_dir, 'missing.png')
+            self.assertRaises(MxitAPIException, users.get_gallery_file, 'unknown', output_file_path=missing)
+            self.assertFalse(os.path.exists(missing))
+            self.assertRaises(MxitAPIException, users.get_gallery_file, 'unknown', output_file_path=path)
+            self.assertEqual(1024, os.path.getsize(path))
+        finally:
+            shutil.rmtree(local_dir)
+
+    def test_contact_list_pages(self):
+        page = self.client.users.get_contact_list('@All', skip=20, count=20)
+        self.assertEqual(['user%d' % i for i in range(20, 30)], [contact['UserId'] for contact in page['Contacts']])
+
+    def test_iter_contact_list(self):
+        for prefetch in (True, False):
+            contacts = list(self.client.users.iter_contact_list('@All', page_size=7, prefetch=prefetch))
+            self.assertEqual(['user%d' % i for i in range(30)], [contact['UserId'] for contact in contacts])
+
+    def test_get_contact_lists(self):
+        contact_lists = self.client.users.get_contact_lists(['@Friends', '@Apps'], page_size=10)
+        self.assertEqual(['@Apps', '@Friends'], sorted(contact_lists))
+        self.assertEqual(30, len(contact_lists['@Apps']))
+
+    def test_iter_gallery_items(self):
+        users = self.client.users
+        self.assertEqual(5, len(users.get_gallery_item_list('Default', skip=0, count=10)))
+
+        items = list(users.iter_gallery_items('Default', page_size=2))
+        self.assertEqual(['file%d.png' % i for i in range(5)], [item['FileName'] for item in items])
+
+    def test_walk_gallery(self):
+        users = self.client.users
+        users.create_gallery_folder('Photos')
+        users.upload_gallery_file('Photos', 'photo.png', 'data')
+
+        walked = sorted((folder_name, item['FileName']) for folder_name, item in users.walk_gallery(page_size=2))
+        self.assertEqual([('Default', 'file%d.png' % i) for i in range(5)] + [('Photos', 'photo.png')], walked)
+
+    def test_mirror_gallery_folder(self):
+        users = self.client.users
+        local_dir = tempfile.mkdtemp()
+        try:
+            result = users.mirror_gallery_folder('Default', local_dir, max_workers=3)
+            self.assertEqual((5, 0, [], {}, 5 * 1024), (len(result.downloaded),) + result[1:])
+            self.assertEqual(1024, os.path.getsize(os.path.join(local_dir, 'file0.png')))
+
+            self.assertEqual(([], 5), users.mirror_gallery_folder('Default', local_dir)[:2])
+
+            deleted_id = self.server.state.folders['Default'][0]
+            users.delete_gallery_file(deleted_id)
+            new_id = json.loads(users.upload_gallery_file('Default', 'file0.png', 'new'))
+
+            result = users.mirror_gallery_folder('Default', local_dir)
+            self.assertEqual(([new_id], 4, [deleted_id], {}, 3), result)
+            self.assertEqual(['.mxit-gallery.json'] + ['file%d.png' % i for i in range(5)],
+                             sorted(os.listdir(local_dir)))
+            with open(os.path.join(local_dir, 'file0.png')) as f:
+                self.assertEqual('new', f.read())
+        finally:
+            shutil.rmtree(local_dir)
+
+    def test_mirror_unsafe_file_names(self):
+        users = self.client.users
+        local_dir = tempfile.mkdtemp()
+        try:
+            file_ids = [json.loads(users.upload_gallery_file('Unsafe', name, 'data'))
+                        for name in ('..', '.', '.mxit-gallery.json.tmp', '../photo.png')]
+
+            result = users.mirror_gallery_folder('Unsafe', local_dir)
+            self.assertEqual((4, {}), (len(result.downloaded), result.failed))
+            self.assertEqual(sorted(['.mxit-gallery.json', 'photo.png'] + file_ids[:3]), sorted(os.listdir(local_dir)))
+        finally:
+            shutil.rmtree(local_dir)
+
+    def test_upload_gallery_files(self):
+        users = self.client.users
+        local_dir = tempfile.mkdtemp()
+        try:
+            for i in range(4):
+                with open(os.path.join(local_dir, 'photo%d.png' % i), 'wb') as f:
+                    f.write('x' * 100)
+
+            result = users.upload_gallery_files('Uploads', local_dir, max_workers=2)
+            self.assertEqual((4, 0, {}, 400), (len(result.uploaded),) + result[1:4])
+            self.assertEqual(['photo%d.png' % i for i in range(4)],
+                             sorted(item['FileName'] for item in users.get_gallery_item_list('Uploads')))
+
+            with open(os.path.join(local_dir, 'photo0.png'), 'ab') as f:
+                f.write('more')
+
+            result = users.upload_gallery_files('Uploads', local_dir)
+            self.assertEqual(([os.path.join(local_dir, 'photo0.png')], 3), (list(result.uploaded), result.skipped))
+
+            # Missing files fail on their own
+            missing = os.path.join(local_dir, 'missing.png')
+            result = users.upload_gallery_files('Uploads', [missing, os.path.join(local_dir, 'photo1.png')],
+                                                manifest_path=os.path.join(local_dir, '.mxit-upload.json'))
+            self.assertEqual(([missing], 1), (list(result.failed), result.skipped))
+            self.assertIsInstance(result.failed[missing], OSError)
+        finally:
+            shutil.rmtree(local_dir)
+
+    def test_upload_gallery_json_files(self):
+        local_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(local_dir, 'data.json'), 'wb') as f:
+                f.write('{"a": 1}')
+
+            result = self.client.users.upload_gallery_files('Uploads', local_dir)
+            self.assertEqual({}, result.failed)
+            item = self.server.state.files[result.uploaded[os.path.join(local_dir, 'data.json')]]
+            self.assertEqual(('application/json', '{"a": 1}'), (item['MimeType'], item['data']))
+        finally:
+            shutil.rmtree(local_dir)
+
+    def test_file_offers_upload_identical_content_once(self):
+        users = UserService(self.client.oauth, self.client.transport, file_id_cache=LRUCache())
+        offers = self.server.state.folders
+
+        with ThreadPoolExecutor(5) as executor:
+            file_ids = set(executor.map(lambda i: users.upload_file_and_send_file_offer('voucher.png', 'user%d' % i,
+                                                                                        'voucher'), range(10)))
+        self.assertEqual(1, len(file_ids))
+        self.assertEqual(1, len(offers['Offers']))
+
+        users.upload_file_and_send_file_offer('voucher.png', 'user0', BytesIO('voucher'))
+        users.upload_file_and_send_file_offer('other.png', 'user0', 'voucher')
+        self.assertEqual(2, len(offers['Offers']))
+
+        # Offers to an unknown user fail without uploading again or dropping the cached FileId
+        self.assertRaises(MxitAPIException, users.upload_file_and_send_file_offer, 'voucher.png', 'unknown',
+                          'voucher')
+        self.assertEqual(2, len(offers['Offers']))
+        self.assertEqual(2, len(users.file_id_cache))
+
+        # Offers of an expired upload upload it again
+        users.delete_gallery_file(json.loads(file_ids.pop()))
+        users.upload_file_and_send_file_offer('voucher.png', 'user0', 'voucher')
+        self.assertEqual(2, len(offers['Offers']))
+
+    def test_file_offers_after_a_failed_upload_upload_once(self):
+        users = UserService(self.client.oauth, self.client.transport, file_id_cache=LRUCache())
+        self.server.latency = 0.05
+
+        # If the offer to the unknown user uploads first, it fails and one of the others takes over the upload
+        with ThreadPoolExecutor(10) as executor:
+            futures = [executor.submit(users.upload_file_and_send_file_offer, 'voucher.png', user_id, 'voucher')
+                       for user_id in ['unknown0'] + ['user%d' % i for i in range(1, 10)]]
+        self.assertIsInstance(futures[0].exception(), MxitAPIException)
+        self.assertEqual(1, len(set(future.result() for future in futures[1:])))
+        self.assertEqual(1, len(self.server.state.folders['Offers']))
+        self.assertEqual(1, len(users.file_id_cache))
+
+    def test_file_offers_racing_a_slow_cache_upload_once(self):
+        users = UserService(self.client.oauth, self.client.transport, file_id_cache=SlowLRUCache())
+
+        first = Thread(target=users.upload_file_and_send_file_offer, args=('voucher.png', 'user1', 'voucher'))
+        first.start()
+        time.sleep(0.02)
+        users.upload_file_and_send_file_offer('voucher.png', 'user2', 'voucher')
+        first.join()
+        self.assertEqual(1, len(self.server.state.folders['Offers']))
+
+    def test_broadcast_file_offer(self):
+        users = self.client.users
+        user_ids = ['user%d' % i for i in range(20)]
+
+        results = users.broadcast_file_offer('voucher.png', user_ids + ['user0'], 'voucher', max_workers=5)
+        self.assertEqual(user_ids, [result.user_id for result in results])
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(1, len(self.server.state.folders['Offers']))
+        self.assertEqual(set([results[0].file_id]), set(result.file_id for result in results))
+
+        # Resuming with the FileId offers it without uploading again
+        results = users.broadcast_file_offer('voucher.png', ['user5'], 'voucher', file_id=results[0].file_id)
+        self.assertTrue(results[0].ok)
+        self.assertEqual(1, len(self.server.state.folders['Offers']))
+
+    def test_broadcast_file_offer_failed_iterator_upload(self):
+        def chunks():
+            yield 'vou'
+            yield 'cher'
+
+        # An iterator can only be uploaded once, so a failed upload fails the whole broadcast
+        results = self.client.users.broadcast_file_offer('voucher.png', ['unknown', 'user1'], chunks())
+        self.assertEqual(['unknown', 'user1'], [result.user_id for result in results])
+        self.assertFalse(any(result.ok for result in results))
+        self.assertEqual(400, results[0].error.args[1]['code'])
+        self.assertEqual('The file could not be uploaded', str(results[1].error))
+        self.assertNotIn('Offers', self.server.state.folders)
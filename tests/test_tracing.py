@@ -0,0 +1,56 @@
+import unittest
+from mxit.oauth import OAuth
+from mxit.services import UserService
+from mxit.tracing import Tracer
+from tests.fake_session import fake_transport
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.spans = []
+        self.transport = fake_transport(body='"user_id"', tracer=Tracer(on_end=self.spans.append))
+        self.users = UserService(OAuth('id', 'secret', transport=self.transport), self.transport)
+
+    def test_phases_of_a_call(self):
+        self.assertEqual('user_id', self.users.get_user_id('someone'))
+
+        names = [(span.name, span.parent.name if span.parent else None) for span in self.spans]
+        self.assertEqual([
+            ('request', 'token'),
+            ('token', 'call'),
+            ('request', 'call'),
+            ('body', 'call'),
+            ('call', None),
+        ], names)
+
+        token, call = self.spans[1], self.spans[-1]
+        self.assertEqual('fetched', token.attributes['source'])
+        self.assertEqual('users.get_user_id', call.attributes['call'])
+        self.assertEqual('/user/lookup/*', self.spans[2].attributes['endpoint'])
+        self.assertTrue(all(span.duration >= 0 for span in self.spans))
+
+    def test_retries_and_cached_tokens(self):
+        self.users.get_user_id('someone')
+        del self.spans[:]
+
+        self.transport.session.outcomes = [503, 200]
+        self.users.get_status('someone')
+
+        self.assertEqual(['token', 'request', 'backoff', 'request', 'body', 'call'],
+                         [span.name for span in self.spans])
+        self.assertEqual('memory', self.spans[0].attributes['source'])
+        self.assertEqual([0, 1], [span.attributes['attempt'] for span in self.spans if span.name == 'request'])
+
+    def test_iterated_results(self):
+        results = self.users.resolve_mxit_ids(['a', 'b'], fields=('user_id',), max_workers=2)
+        self.assertEqual([], self.spans)
+
+        self.assertEqual(2, len(list(results)))
+        call = self.spans[-1]
+        self.assertEqual('users.resolve_mxit_ids', call.attributes['call'])
+
+        def root(span):
+            return root(span.parent) if span.parent is not None else span
+        self.assertTrue(all(root(span) is call for span in self.spans))
+        self.assertEqual(2, len([span for span in self.spans if span.parent is call]))
+        self.assertTrue(all(span.end_time <= call.end_time for span in self.spans))